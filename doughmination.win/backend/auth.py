@@ -9,6 +9,7 @@ import logging
 from dotenv import load_dotenv
 from users import verify_user, get_user_by_username
 from models import UserResponse
+from http_clients import get_client
 
 load_dotenv()
 
@@ -61,18 +62,18 @@ async def verify_turnstile_token(token: str, remote_ip: str = None) -> bool:
         data["remoteip"] = remote_ip
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(verify_url, data=data)
-            response.raise_for_status()
-            
-            result = TurnstileResponse(**response.json())
-            
-            if not result.success:
-                logger.warning(f"Turnstile verification failed: {result.error_codes}")
-                return False
-            
-            logger.info("Turnstile verification successful")
-            return True
+        client = get_client("turnstile")
+        response = await client.post(verify_url, data=data)
+        response.raise_for_status()
+        
+        result = TurnstileResponse(**response.json())
+        
+        if not result.success:
+            logger.warning(f"Turnstile verification failed: {result.error_codes}")
+            return False
+        
+        logger.info("Turnstile verification successful")
+        return True
             
     except httpx.RequestError as e:
         logger.error(f"Failed to verify Turnstile token: {e}")
@@ -0,0 +1,75 @@
+"""
+Microbenchmarks for switch timestamp parsing.
+
+Compares the PluralKit fast path and its memoized form against
+datetime.fromisoformat, the general parse_timestamp and a hand-written
+fixed-format parser, on timestamps shaped like PluralKit's:
+
+    python bench_timestamps.py
+    python bench_timestamps.py --count 100000 --repeat 5
+"""
+import argparse
+import random
+import timeit
+from datetime import date, datetime, timedelta, timezone
+
+from metrics import parse_timestamp, parse_timestamp_us, timestamp_to_us
+from metrics_engine import datetime_to_us
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def make_timestamps(count: int):
+    """Random PluralKit-style timestamps (UTC, "Z" suffix, microseconds) over the last two years"""
+    now = datetime.now(timezone.utc)
+    return [
+        (now - timedelta(microseconds=random.randrange(2 * 365 * 86400 * 1_000_000))).isoformat().replace("+00:00", "Z")
+        for _ in range(count)
+    ]
+
+
+def parse_fixed_format_us(s: str) -> int:
+    """Slice-based parser for "YYYY-MM-DDTHH:MM:SS.ffffffZ", for comparison with the C parser"""
+    days = date(int(s[0:4]), int(s[5:7]), int(s[8:10])).toordinal() - EPOCH_ORDINAL
+    seconds = days * 86400 + int(s[11:13]) * 3600 + int(s[14:16]) * 60 + int(s[17:19])
+    micros = int(s[20:-1][:6].ljust(6, "0")) if s[19] == "." else 0
+    return seconds * 1_000_000 + micros
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark switch timestamp parsing")
+    parser.add_argument("--count", type=int, default=10000, help="timestamps per run (default: 10000)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per parser, best is reported (default: 5)")
+    args = parser.parse_args()
+
+    timestamps = make_timestamps(args.count)
+
+    # Every parser has to agree before timing them
+    for ts in timestamps[:1000]:
+        expected = datetime_to_us(parse_timestamp(ts))
+        assert parse_timestamp_us(ts) == expected == timestamp_to_us(ts) == parse_fixed_format_us(ts), ts
+
+    timestamp_to_us.cache_clear()
+    for ts in timestamps:
+        timestamp_to_us(ts)
+
+    parsers = [
+        ("datetime.fromisoformat", lambda: [datetime.fromisoformat(ts) for ts in timestamps]),
+        ("parse_timestamp", lambda: [parse_timestamp(ts) for ts in timestamps]),
+        ("parse_timestamp -> us", lambda: [datetime_to_us(parse_timestamp(ts)) for ts in timestamps]),
+        ("fixed-format slicing -> us", lambda: [parse_fixed_format_us(ts) for ts in timestamps]),
+        ("parse_timestamp_us", lambda: [parse_timestamp_us(ts) for ts in timestamps]),
+        ("timestamp_to_us (memoized)", lambda: [timestamp_to_us(ts) for ts in timestamps]),
+    ]
+
+    print(f"{args.count} timestamps, best of {args.repeat} runs")
+    baseline = None
+    for name, run in parsers:
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        per_call_ns = best / args.count * 1e9
+        baseline = baseline or best
+        print(f"  {name:<28} {best * 1000:8.2f} ms  {per_call_ns:7.0f} ns/call  {baseline / best:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,682 @@
+import asyncio
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
 import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
-_cache = {}
+from dotenv import load_dotenv
+from persistence import atomic_write
 
-def get_from_cache(key):
-    if key in _cache:
-        value, expire_time = _cache[key]
-        if time.time() < expire_time:
-            return value
-        else:
-            del _cache[key]  # expired
-    return None
+load_dotenv()
 
-def set_in_cache(key, value, ttl=30):
-    expire_time = time.time() + ttl
-    _cache[key] = (value, expire_time)
+# Default TTL for any key whose namespace has no explicit default
+CACHE_TTL = int(os.getenv("CACHE_TTL", 30))
+
+# Hard limits for the whole cache
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 32 * 1024 * 1024))  # 32MB
+
+# How long an entry may keep being served stale (while it is refreshed in the
+# background) after its TTL runs out, for callers that opt into it
+CACHE_MAX_STALE = int(os.getenv("CACHE_MAX_STALE", 300))
+
+# Which cache backend to use:
+#   memory - a private in-process cache per worker (default)
+#   shared - one SQLite database on the host that every uvicorn worker opens,
+#            so all workers see the same entries and the same invalidations
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+# Defaults to tmpfs where available, so the shared cache lives in shared memory
+CACHE_SHARED_PATH = os.getenv(
+    "CACHE_SHARED_PATH",
+    "/dev/shm/doughmination-cache.db" if os.path.isdir("/dev/shm") else "dough-data/cache.db"
+)
+
+# How often the background sweeper drops expired entries
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", 60))
+
+# Optional on-disk snapshot of selected namespaces, so restarts come up warm.
+# The snapshot is written on shutdown and every CACHE_SNAPSHOT_INTERVAL seconds,
+# and loaded at startup with each entry's original expiry.
+CACHE_SNAPSHOT = os.getenv("CACHE_SNAPSHOT", "false").lower() in ("1", "true", "yes")
+CACHE_SNAPSHOT_FILE = os.getenv("CACHE_SNAPSHOT_FILE", "dough-data/cache_snapshot.json")
+CACHE_SNAPSHOT_INTERVAL = int(os.getenv("CACHE_SNAPSHOT_INTERVAL", 300))
+CACHE_SNAPSHOT_NAMESPACES = [
+    namespace.strip()
+    for namespace in os.getenv("CACHE_SNAPSHOT_NAMESPACES", "system,members,fronters").split(",")
+    if namespace.strip()
+]
+
+# Per-namespace TTL defaults. The namespace of a key is the part before the
+# first underscore, so "switches_1000" lives in the "switches" namespace.
+# Any namespace can be overridden with CACHE_TTL_<NAMESPACE>, e.g. CACHE_TTL_SWITCHES=120
+NAMESPACE_TTLS: Dict[str, int] = {
+    "system": CACHE_TTL,
+    "members": CACHE_TTL,
+    "fronters": CACHE_TTL,
+    "switches": CACHE_TTL,
+    # Metrics keys include the data versions and the minute, so this only bounds memory use
+    "metrics": 120,
+}
+for _env_key, _env_value in os.environ.items():
+    if _env_key.startswith("CACHE_TTL_"):
+        NAMESPACE_TTLS[_env_key[len("CACHE_TTL_"):].lower()] = int(_env_value)
+
+
+class _Miss:
+    """Sentinel returned for cache misses, so cached falsy values still count as hits"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "MISS"
+
+    def __bool__(self):
+        return False
+
+
+MISS = _Miss()
+
+
+def get_namespace(key: str) -> str:
+    """Get the namespace a cache key belongs to"""
+    return key.split("_", 1)[0]
+
+
+def get_namespace_ttl(key: str) -> int:
+    """Get the default TTL for the namespace of a cache key"""
+    return NAMESPACE_TTLS.get(get_namespace(key), CACHE_TTL)
+
+
+def estimate_size(value: Any) -> int:
+    """Rough size of a cached value in bytes, based on its JSON encoding"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "stale_time", "expire_time", "size", "tags")
+
+    def __init__(self, value: Any, stale_time: float, expire_time: float, size: int, tags: frozenset):
+        self.value = value
+        self.stale_time = stale_time  # soft expiry, the entry is stale after this
+        self.expire_time = expire_time  # hard expiry, the entry is gone after this
+        self.size = size
+        self.tags = tags  # dependency tags, see invalidate_tags()
+
+
+class CacheEngine:
+    """
+    Bounded in-process cache (the "memory" backend) with TTL expiry and LRU eviction.
+
+    Entries are evicted least-recently-used first whenever the entry count or
+    the estimated byte budget is exceeded, and expired entries are dropped by
+    sweep_expired() even if nobody reads them again.
+
+    An entry stored with a stale_ttl stays readable through get_entry() for
+    that long after its TTL runs out, flagged as stale, so callers can serve
+    it while refreshing in the background. get() only ever returns fresh values.
+
+    Entries can be tagged with the data they were derived from, so one
+    invalidate_tags() call drops every dependent entry at once.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._tag_index: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str, default: Any = MISS) -> Any:
+        entry = self.get_entry(key)
+        if entry is None or entry[1]:
+            return default
+        return entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, bool]]:
+        """Get (value, is_stale) for a key, or None if it is missing or hard-expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now >= entry.expire_time:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if now >= entry.stale_time:
+                self.stale_hits += 1
+                return entry.value, True
+            self.hits += 1
+            return entry.value, False
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, stale_ttl: int = 0,
+            tags: Iterable[str] = ()):
+        if ttl is None:
+            ttl = get_namespace_ttl(key)
+
+        # A non-positive TTL is how callers invalidate an entry
+        if ttl <= 0:
+            self.delete(key)
+            return
+
+        now = time.time()
+        self._store(key, value, now + ttl, now + ttl + max(stale_ttl, 0), tags)
+
+    def _store(self, key: str, value: Any, stale_time: float, expire_time: float, tags: Iterable[str]) -> bool:
+        """Store an entry with absolute expiry times, returning False if it is too big to cache"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            size = estimate_size(value)
+            if size > self.max_bytes:
+                print(f"Cache entry '{key}' ({size} bytes) exceeds the cache byte budget, not caching")
+                return False
+
+            entry = _Entry(value, stale_time, expire_time, size, frozenset(tags))
+            self._entries[key] = entry
+            self._bytes += size
+            for tag in entry.tags:
+                self._tag_index.setdefault(tag, set()).add(key)
+            self._evict()
+            return key in self._entries
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Drop every entry carrying any of the given tags, returning how many were removed"""
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tag_index.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_index.clear()
+            self._bytes = 0
+
+    def sweep_expired(self) -> int:
+        """Drop every expired entry, returning how many were removed"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if now >= entry.expire_time]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def export_entries(self, namespaces: Iterable[str]) -> List[Dict[str, Any]]:
+        """Get every live entry in the given namespaces, with absolute expiry times"""
+        namespaces = set(namespaces)
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "key": key,
+                    "value": entry.value,
+                    "stale_time": entry.stale_time,
+                    "expire_time": entry.expire_time,
+                    "tags": sorted(entry.tags),
+                }
+                for key, entry in self._entries.items()
+                if get_namespace(key) in namespaces and now < entry.expire_time
+            ]
+
+    def import_entry(self, key: str, value: Any, stale_time: float, expire_time: float,
+                     tags: Iterable[str] = ()) -> bool:
+        """Store an entry with absolute expiry times, e.g. from a snapshot, returning whether it was stored"""
+        if time.time() >= expire_time:
+            return False
+        # Stored as is, so entries past their soft expiry come back stale instead of being dropped
+        return self._store(key, value, stale_time, expire_time, tags)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "tags": {tag: len(keys) for tag, keys in self._tag_index.items()},
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        self._untag(key, entry)
+
+    def _untag(self, key: str, entry: _Entry):
+        for tag in entry.tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._untag(key, entry)
+            self.evictions += 1
+
+
+class SharedCacheEngine:
+    """
+    Cache backend shared by every worker process on the host (the "shared" backend).
+
+    Entries live in a SQLite database in WAL mode, memory-mapped and by default
+    placed on /dev/shm, so reads stay cheap while every worker sees the same
+    entries, the same LRU limits and the same tag invalidations. Values are
+    pickled. It has the same interface and semantics as CacheEngine.
+    """
+
+    def __init__(self, path: str = CACHE_SHARED_PATH, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Per-worker counters, the entries themselves are shared
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")  # it's a cache, losing it is fine
+        self._conn.execute(f"PRAGMA mmap_size={max_bytes * 2}")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                stale_time REAL NOT NULL,
+                expire_time REAL NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cache_entries_last_access ON cache_entries (last_access);
+            CREATE INDEX IF NOT EXISTS cache_entries_expire_time ON cache_entries (expire_time);
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, key)
+            );
+            CREATE INDEX IF NOT EXISTS cache_tags_key ON cache_tags (key);
+        """)
+
+    def get(self, key: str, default: Any = MISS) -> Any:
+        entry = self.get_entry(key)
+        if entry is None or entry[1]:
+            return default
+        return entry[0]
+
+    def get_entry(self, key: str) -> Optional[Tuple[Any, bool]]:
+        """Get (value, is_stale) for a key, or None if it is missing or hard-expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stale_time, expire_time, last_access FROM cache_entries WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            blob, stale_time, expire_time, last_access = row
+            if now >= expire_time:
+                self._delete_keys([key])
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # Only touch the LRU clock once a second per key to keep reads read-only
+            if now - last_access >= 1:
+                self._conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (now, key))
+            is_stale = now >= stale_time
+            if is_stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+        return pickle.loads(blob), is_stale
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, stale_ttl: int = 0,
+            tags: Iterable[str] = ()):
+        if ttl is None:
+            ttl = get_namespace_ttl(key)
+
+        if ttl <= 0:
+            self.delete(key)
+            return
+
+        now = time.time()
+        self._store(key, value, now + ttl, now + ttl + max(stale_ttl, 0), tags)
+
+    def _store(self, key: str, value: Any, stale_time: float, expire_time: float, tags: Iterable[str]) -> bool:
+        """Store an entry with absolute expiry times, returning False if it is too big to cache"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            print(f"Cache entry '{key}' ({len(blob)} bytes) exceeds the cache byte budget, not caching")
+            self.delete(key)
+            return False
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, value, stale_time, expire_time, size, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, blob, stale_time, expire_time, len(blob), now)
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                    [(tag, key) for tag in set(tags)]
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._delete_keys([key]) > 0
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Drop every entry carrying any of the given tags, returning how many were removed"""
+        if not tags:
+            return 0
+        placeholders = ",".join("?" * len(tags))
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT key FROM cache_tags WHERE tag IN ({placeholders})", tags
+            )]
+            removed = self._delete_keys(keys)
+            self.invalidations += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries")
+            self._conn.execute("DELETE FROM cache_tags")
+
+    def sweep_expired(self) -> int:
+        """Drop every expired entry, returning how many were removed"""
+        now = time.time()
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(
+                "SELECT key FROM cache_entries WHERE expire_time <= ?", (now,)
+            )]
+            removed = self._delete_keys(keys)
+            self.expirations += removed
+        return removed
+
+    def export_entries(self, namespaces: Iterable[str]) -> List[Dict[str, Any]]:
+        """Get every live entry in the given namespaces, with absolute expiry times"""
+        namespaces = set(namespaces)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, stale_time, expire_time FROM cache_entries WHERE expire_time > ?", (now,)
+            ).fetchall()
+            tags: Dict[str, List[str]] = {}
+            for tag, key in self._conn.execute("SELECT tag, key FROM cache_tags ORDER BY tag"):
+                tags.setdefault(key, []).append(tag)
+        return [
+            {
+                "key": key,
+                "value": pickle.loads(blob),
+                "stale_time": stale_time,
+                "expire_time": expire_time,
+                "tags": tags.get(key, []),
+            }
+            for key, blob, stale_time, expire_time in rows
+            if get_namespace(key) in namespaces
+        ]
+
+    def import_entry(self, key: str, value: Any, stale_time: float, expire_time: float,
+                     tags: Iterable[str] = ()) -> bool:
+        """Store an entry with absolute expiry times, e.g. from a snapshot, returning whether it was stored"""
+        if time.time() >= expire_time:
+            return False
+        # Stored as is, so entries past their soft expiry come back stale instead of being dropped
+        return self._store(key, value, stale_time, expire_time, tags)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+            tags = dict(self._conn.execute("SELECT tag, COUNT(*) FROM cache_tags GROUP BY tag").fetchall())
+        return {
+            "backend": "shared",
+            "path": self.path,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "tags": tags,
+        }
+
+    def _delete_keys(self, keys) -> int:
+        removed = 0
+        for key in keys:
+            cursor = self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+            removed += cursor.rowcount
+        return removed
+
+    def _evict(self):
+        entries, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache_entries ORDER BY last_access"):
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            victims.append(key)
+            entries -= 1
+            total_bytes -= size
+        self.evictions += self._delete_keys(victims)
+
+
+def create_cache_backend(backend: str = CACHE_BACKEND):
+    """Create the cache backend selected by CACHE_BACKEND"""
+    if backend == "shared":
+        try:
+            engine = SharedCacheEngine()
+            print(f"Using shared cache backend at {engine.path}")
+            return engine
+        except sqlite3.Error as e:
+            print(f"Could not open shared cache at {CACHE_SHARED_PATH}: {e}, falling back to in-process cache")
+    elif backend != "memory":
+        print(f"Unknown CACHE_BACKEND '{backend}', using in-process cache")
+    return CacheEngine()
+
+
+_cache = create_cache_backend()
+
+def get_from_cache(key, default=None):
+    """Get a fresh cached value, or default on a miss (pass default=MISS to tell misses from cached None/[])"""
+    return _cache.get(key, default)
+
+def get_cache_entry(key):
+    return _cache.get_entry(key)
+
+def set_in_cache(key, value, ttl=None, stale_ttl=0, tags=()):
+    _cache.set(key, value, ttl, stale_ttl, tags)
+
+def delete_from_cache(key):
+    return _cache.delete(key)
+
+def invalidate_tags(*tags):
+    """Drop every cached entry derived from any of the given tags"""
+    return _cache.invalidate_tags(*tags)
+
+def get_cache_stats():
+    return _cache.stats()
+
+# ============================================================================
+# BACKGROUND SWEEPER
+# ============================================================================
+
+_sweeper_task: Optional[asyncio.Task] = None
+
+async def _sweep_loop(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = _cache.sweep_expired()
+            if removed:
+                print(f"Cache sweeper removed {removed} expired entries")
+        except Exception as e:
+            print(f"Error in cache sweeper: {e}")
+
+def start_sweeper(interval: int = CACHE_SWEEP_INTERVAL):
+    """Start the background task that drops expired cache entries"""
+    global _sweeper_task
+    if _sweeper_task is None or _sweeper_task.done():
+        _sweeper_task = asyncio.create_task(_sweep_loop(interval))
+
+async def stop_sweeper():
+    """Stop the background sweeper task"""
+    global _sweeper_task
+    if _sweeper_task is not None:
+        _sweeper_task.cancel()
+        try:
+            await _sweeper_task
+        except asyncio.CancelledError:
+            pass
+        _sweeper_task = None
+
+# ============================================================================
+# SNAPSHOTS
+# ============================================================================
+
+def save_cache_snapshot(path: str = CACHE_SNAPSHOT_FILE, namespaces: Iterable[str] = CACHE_SNAPSHOT_NAMESPACES) -> int:
+    """Write the live entries of the given namespaces to disk, returning how many were saved"""
+    entries = _cache.export_entries(namespaces)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Serialized one by one, so a value JSON can't represent only costs its own entry
+    serialized = []
+    for entry in entries:
+        try:
+            serialized.append(json.dumps(entry))
+        except (TypeError, ValueError) as e:
+            print(f"Skipping cache entry {entry['key']} in snapshot: {e}")
+
+    # Written atomically so a crash never leaves a truncated snapshot
+    atomic_write(path, f'{{"saved_at": {json.dumps(time.time())}, "entries": [{", ".join(serialized)}]}}')
+    return len(serialized)
+
+def load_cache_snapshot(path: str = CACHE_SNAPSHOT_FILE) -> int:
+    """Load a snapshot written by save_cache_snapshot(), returning how many entries were restored"""
+    if not os.path.exists(path):
+        return 0
+
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read cache snapshot {path}: {e}")
+        return 0
+
+    restored = 0
+    now = time.time()
+    for entry in snapshot.get("entries", []):
+        # Entries keep their original expiry, anything that ran out while we were down is skipped
+        if entry["expire_time"] <= now:
+            continue
+        if _cache.import_entry(entry["key"], entry["value"], entry["stale_time"], entry["expire_time"], entry.get("tags", ())):
+            restored += 1
+    return restored
+
+_snapshot_task: Optional[asyncio.Task] = None
+
+async def _snapshot_loop(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            save_cache_snapshot()
+        except Exception as e:
+            print(f"Error writing cache snapshot: {e}")
+
+def start_snapshots(interval: int = CACHE_SNAPSHOT_INTERVAL):
+    """Restore the cache snapshot and start writing new ones periodically (if CACHE_SNAPSHOT is enabled)"""
+    global _snapshot_task
+    if not CACHE_SNAPSHOT:
+        return
+    restored = load_cache_snapshot()
+    print(f"Restored {restored} cache entries from snapshot")
+    if _snapshot_task is None or _snapshot_task.done():
+        _snapshot_task = asyncio.create_task(_snapshot_loop(interval))
+
+async def stop_snapshots():
+    """Stop the snapshot task and write a final snapshot (if CACHE_SNAPSHOT is enabled)"""
+    global _snapshot_task
+    if not CACHE_SNAPSHOT:
+        return
+    if _snapshot_task is not None:
+        _snapshot_task.cancel()
+        try:
+            await _snapshot_task
+        except asyncio.CancelledError:
+            pass
+        _snapshot_task = None
+    try:
+        saved = save_cache_snapshot()
+        print(f"Saved {saved} cache entries to snapshot")
+    except Exception as e:
+        print(f"Error writing cache snapshot: {e}")
@@ -0,0 +1,111 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from tags import get_member_tags_snapshot, lookup_member_tags
+from member_status import get_statuses_snapshot, lookup_member_status
+
+
+def enrich_members(members: List[Dict]) -> List[Dict]:
+    """
+    Add tags and status to every member in a single pass.
+
+    Each store is read once per call, from its in-memory snapshot, instead of
+    once per member. The tag lists and statuses are shared with the snapshots,
+    so the result must not be modified.
+    """
+    member_tags = get_member_tags_snapshot()
+    statuses = get_statuses_snapshot()
+    return [
+        {
+            **member,
+            "tags": lookup_member_tags(member_tags, member),
+            "status": lookup_member_status(statuses, member)
+        }
+        for member in members
+    ]
+
+
+def to_json_bytes(data: Any) -> bytes:
+    """Serialize like FastAPI's JSONResponse does"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+# ============================================================================
+# ENRICHED MEMBER SNAPSHOT
+# ============================================================================
+
+class EnrichedMembers:
+    """
+    Every member with tags and status, built once per member registry, tag and
+    status snapshot, and serialized up front.
+
+    The snapshot is built from exactly the objects it is keyed by, and each of
+    those is replaced (never changed) when its data changes, so an identity
+    check is enough to tell whether it is current. Everything in it is shared
+    and must not be modified.
+    """
+
+    def __init__(self, registry, member_tags: Dict[str, List[str]], statuses: Dict[str, Dict]):
+        self.registry = registry
+        self.member_tags = member_tags
+        self.statuses = statuses
+        self.members: Tuple[Dict, ...] = tuple(
+            {
+                **member,
+                "tags": lookup_member_tags(member_tags, member),
+                "status": lookup_member_status(statuses, member)
+            }
+            for member in registry.members
+        )
+        self.by_id: Dict[str, Dict] = {}
+        for member in self.members:
+            if member.get("id"):
+                self.by_id.setdefault(member["id"], member)
+        self.json = to_json_bytes(self.members)
+        self.member_json: Dict[str, bytes] = {member_id: to_json_bytes(member) for member_id, member in self.by_id.items()}
+        # Last fronters object serialized against this snapshot, usually the same cached object every time
+        self._fronters: Optional[Tuple[Dict, bytes]] = None
+
+    def is_current(self, registry, member_tags: Dict[str, List[str]], statuses: Dict[str, Dict]) -> bool:
+        return self.registry is registry and self.member_tags is member_tags and self.statuses is statuses
+
+    def find(self, identifier: str) -> Optional[Dict]:
+        """Get an enriched member by id, falling back to name (case-insensitive)"""
+        member = self.registry.find(identifier)
+        return self.by_id.get(member["id"]) if member and member.get("id") else None
+
+    def enrich_fronters(self, fronters_data: Dict) -> Dict:
+        """Fronters with their members replaced by the enriched ones"""
+        if "members" not in fronters_data:
+            return fronters_data
+        members = fronters_data["members"]
+        enriched = [self.by_id.get(member.get("id")) for member in members]
+        if None in enriched:
+            # Fronters that aren't in the registry (yet)
+            missing = enrich_members([member for member, found in zip(members, enriched) if found is None])
+            enriched = [found if found is not None else missing.pop(0) for found in enriched]
+        return {**fronters_data, "members": enriched}
+
+    def fronters_json(self, fronters_data: Dict) -> bytes:
+        """Serialized enriched fronters, reused while the same fronters object is passed in"""
+        cached = self._fronters
+        if cached is not None and cached[0] is fronters_data:
+            return cached[1]
+        encoded = to_json_bytes(self.enrich_fronters(fronters_data))
+        self._fronters = (fronters_data, encoded)
+        return encoded
+
+
+_enriched: Optional[EnrichedMembers] = None
+
+async def get_enriched_members() -> EnrichedMembers:
+    """Get the enriched member snapshot, rebuilt only when the members, tags or statuses changed"""
+    global _enriched
+    from pluralkit import get_member_registry
+    registry = await get_member_registry()
+    member_tags = get_member_tags_snapshot()
+    statuses = get_statuses_snapshot()
+    snapshot = _enriched
+    if snapshot is None or not snapshot.is_current(registry, member_tags, statuses):
+        snapshot = _enriched = EnrichedMembers(registry, member_tags, statuses)
+    return snapshot
@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from metrics import timestamp_to_us, us_to_isoformat, get_member_details
+from metrics_engine import US_PER_SECOND, datetime_to_us
+from switch_store import switch_store
+
+# Media types of the supported export formats
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Rows per chunk written to the response, and switches per query to the switch store
+EXPORT_CHUNK_ROWS = 1000
+
+SWITCH_FIELDS = ["id", "timestamp", "members"]
+INTERVAL_FIELDS = ["member_id", "member_name", "start", "end", "duration_seconds", "ongoing"]
+
+
+def parse_range(start: Optional[str], end: Optional[str]):
+    """Parse optional from/to timestamps to epoch microseconds, raising ValueError for bad ranges"""
+    start_us = timestamp_to_us(start) if start else None
+    end_us = timestamp_to_us(end) if end else None
+    if start_us is not None and end_us is not None and end_us <= start_us:
+        raise ValueError("'to' must be after 'from'")
+    return start_us, end_us
+
+
+# ============================================================================
+# ROWS
+# ============================================================================
+
+def iter_switch_rows(start_us: Optional[int] = None, end_us: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Switches oldest first, as stored"""
+    for switch in switch_store.iter_switches(start_us, end_us, chunk_size=EXPORT_CHUNK_ROWS):
+        yield {"id": switch["id"], "timestamp": switch["timestamp"], "members": switch["members"]}
+
+
+def iter_fronting_intervals(start_us: Optional[int], end_us: Optional[int], now_us: int,
+                            member_names: Dict[str, str]) -> Iterator[Dict[str, Any]]:
+    """
+    Continuous fronting intervals per member, in the order they end.
+
+    A member stays in front across switches that keep them in, so an interval
+    runs from the switch that brought them in to the one that took them out.
+    Intervals are clipped to the range; members still fronting at its end
+    are emitted last, with `ongoing` set when the range reaches the present.
+    """
+    # Members in front and since when, in the order they came in
+    fronting: Dict[str, int] = {}
+
+    def interval(member_id: str, since_us: int, until_us: int, ongoing: bool = False) -> Dict[str, Any]:
+        return {
+            "member_id": member_id,
+            "member_name": member_names.get(member_id, member_id),
+            "start": us_to_isoformat(since_us),
+            "end": None if ongoing else us_to_isoformat(until_us),
+            "duration_seconds": (until_us - since_us) / US_PER_SECOND,
+            "ongoing": ongoing
+        }
+
+    if start_us is not None:
+        previous = switch_store.switch_before(start_us)
+        if previous is not None:
+            fronting = dict.fromkeys(previous["members"], start_us)
+
+    limit_us = now_us if end_us is None else min(end_us, now_us)
+    for switch in switch_store.iter_switches(start_us, limit_us, chunk_size=EXPORT_CHUNK_ROWS):
+        ts_us = switch["ts_us"]
+        members = dict.fromkeys(switch["members"])
+        for member_id in [member_id for member_id in fronting if member_id not in members]:
+            since_us = fronting.pop(member_id)
+            if ts_us > since_us:
+                yield interval(member_id, since_us, ts_us)
+        for member_id in members:
+            fronting.setdefault(member_id, ts_us)
+
+    ongoing = end_us is None or end_us >= now_us
+    for member_id, since_us in fronting.items():
+        if limit_us > since_us:
+            yield interval(member_id, since_us, limit_us, ongoing)
+
+
+# ============================================================================
+# FORMATS
+# ============================================================================
+
+def ndjson_chunks(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """One JSON object per line, written in chunks of EXPORT_CHUNK_ROWS lines"""
+    lines: List[str] = []
+    for row in rows:
+        lines.append(json.dumps(row, separators=(",", ":")))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def csv_chunks(rows: Iterator[Dict[str, Any]], fields: List[str]) -> Iterator[str]:
+    """CSV with a header row, lists joined by spaces, written in chunks of EXPORT_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([
+            " ".join(value) if isinstance(value, list) else ("" if value is None else value)
+            for value in (row.get(field) for field in fields)
+        ])
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def format_rows(rows: Iterator[Dict[str, Any]], fields: List[str], export_format: str) -> Iterator[str]:
+    if export_format == "csv":
+        return csv_chunks(rows, fields)
+    return ndjson_chunks(rows)
+
+
+# ============================================================================
+# EXPORTS
+# ============================================================================
+
+def export_switches(export_format: str, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream the switch history between two timestamps as NDJSON or CSV.
+
+    The range is parsed up front (raising ValueError), the rows are read from
+    the switch store in chunks as the response is written.
+    """
+    start_us, end_us = parse_range(start, end)
+    return format_rows(iter_switch_rows(start_us, end_us), SWITCH_FIELDS, export_format)
+
+
+async def export_fronting_intervals(export_format: str, start: Optional[str] = None,
+                                    end: Optional[str] = None) -> Iterator[str]:
+    """Stream per-member fronting intervals between two timestamps as NDJSON or CSV"""
+    start_us, end_us = parse_range(start, end)
+    now_us = datetime_to_us(datetime.now(timezone.utc))
+    member_names = {member_id: details["name"] for member_id, details in (await get_member_details()).items()}
+    rows = iter_fronting_intervals(start_us, end_us, now_us, member_names)
+    return format_rows(rows, INTERVAL_FIELDS, export_format)
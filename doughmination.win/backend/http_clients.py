@@ -0,0 +1,129 @@
+import importlib.util
+import os
+import weakref
+from typing import Any, Dict
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Connection pool and timeout settings shared by every upstream client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 15))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", 15))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", 5))
+# HTTP/2 needs the optional "h2" package (pip install httpx[http2])
+HTTP2 = os.getenv("HTTP2", "false").lower() in ("1", "true", "yes")
+
+# One pooled client per upstream service
+UPSTREAMS = ("pluralkit", "turnstile")
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+_seen_connections: Dict[str, "weakref.WeakSet"] = {}
+_http2_enabled: Dict[str, bool] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        print("HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def _pool_connections(client: httpx.AsyncClient) -> list:
+    """Get the connections of a client's pool (httpx doesn't expose this publicly)"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []) or [])
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    stats = _stats.setdefault(name, {"requests": 0, "responses": 0, "errors": 0, "connections_opened": 0})
+    seen = _seen_connections.setdefault(name, weakref.WeakSet())
+
+    async def on_request(request: httpx.Request):
+        stats["requests"] += 1
+
+    async def on_response(response: httpx.Response):
+        stats["responses"] += 1
+        if response.status_code >= 500:
+            stats["errors"] += 1
+        # Count every connection the pool has opened, so reuse = requests / connections_opened
+        for connection in _pool_connections(client):
+            if connection not in seen:
+                seen.add(connection)
+                stats["connections_opened"] += 1
+
+    _http2_enabled[name] = _http2_available()
+    client = httpx.AsyncClient(
+        http2=_http2_enabled[name],
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT,
+        ),
+        event_hooks={"request": [on_request], "response": [on_response]},
+    )
+    return client
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Get the shared client for an upstream.
+
+    Clients are normally created by start_clients() in the app lifespan, but
+    are created lazily here too so scripts and background tasks work without it.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        _clients[name] = client
+    return client
+
+
+async def start_clients():
+    """Create the pooled client for every upstream"""
+    for name in UPSTREAMS:
+        get_client(name)
+
+
+async def close_clients():
+    """Close every client and its pooled connections"""
+    for name, client in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"Error closing HTTP client '{name}': {e}")
+    _clients.clear()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get request counts and connection pool usage for every upstream client"""
+    result = {}
+    for name, client in _clients.items():
+        connections = _pool_connections(client)
+        idle = sum(1 for connection in connections if getattr(connection, "is_idle", lambda: False)())
+        stats = dict(_stats.get(name, {}))
+        opened = stats.get("connections_opened", 0)
+        result[name] = {
+            **stats,
+            "open_connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "requests_per_connection": (stats.get("requests", 0) / opened) if opened else 0,
+            "http2": _http2_enabled.get(name, False),
+            "closed": client.is_closed,
+        }
+    return result
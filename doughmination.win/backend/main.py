@@ -9,12 +9,13 @@ import json
 import asyncio
 import re
 import weakref
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Optional, Set, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Request, Depends, Security, status, File, UploadFile, WebSocket, WebSocketDisconnect, Body
-from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, Response, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, Depends, Security, status, File, UploadFile, WebSocket, WebSocketDisconnect, Body, BackgroundTasks, Query
+from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, Response, HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -23,28 +24,63 @@ from jose import JWTError
 from dotenv import load_dotenv
 
 # Local imports
-from pluralkit import get_system, get_members, get_fronters, set_front
+from pluralkit import (
+    get_system, get_members, get_fronters, set_front, get_singleflight_stats,
+    get_rate_limit_stats, get_member_registry
+)
 from auth import router as auth_router, get_current_user, oauth2_scheme
 from tags import (
     get_member_tags, update_member_tags, add_member_tag, remove_member_tag,
-    enrich_members_with_tags, initialize_default_tags
+    initialize_default_tags
 )
 from models import (
     UserCreate, UserResponse, UserUpdate, MentalState
 )
 from users import get_users, create_user, delete_user, initialize_admin_user, update_user, get_user_by_id
-from metrics import get_fronting_time_metrics, get_switch_frequency_metrics
+from metrics import (
+    get_fronting_time_metrics, get_switch_frequency_metrics, get_metrics_summary,
+    get_fronting_heatmap, get_cofronting_metrics, get_time_series_metrics,
+    start_metrics_precompute, stop_metrics_precompute
+)
+from storage import get_document, set_document
+from persistence import flush_pending_writes
+from enrichment import enrich_members, get_enriched_members
+from export import EXPORT_FORMATS, export_switches, export_fronting_intervals
 from member_status import (
     get_member_status, set_member_status, clear_member_status,
-    enrich_members_with_status, initialize_status_storage
+    initialize_status_storage
 )
+from cache import start_sweeper, stop_sweeper, start_snapshots, stop_snapshots, get_cache_stats
+from http_clients import start_clients, close_clients, get_pool_stats
+from webhooks import is_webhook_configured, verify_dispatch, apply_dispatch_event
+from switch_store import switch_store, start_switch_sync, stop_switch_sync
 
 # ============================================================================
 # APPLICATION SETUP
 # ============================================================================
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pooled upstream HTTP clients
+    await start_clients()
+    # Warm the cache from the last snapshot, then start background cache maintenance
+    start_snapshots()
+    start_sweeper()
+    # Backfill and then keep syncing the local switch history
+    start_switch_sync()
+    # Keep the metrics dashboard's default view precomputed
+    start_metrics_precompute()
+    yield
+    await stop_metrics_precompute()
+    await stop_switch_sync()
+    await stop_sweeper()
+    await stop_snapshots()
+    await close_clients()
+    # Write store changes that are still waiting out their flush delay
+    flush_pending_writes()
+
+app = FastAPI(lifespan=lifespan)
 
 # Initialize the admin user if no users exist
 initialize_admin_user()
@@ -123,7 +159,6 @@ async def get_optional_user(token: str = Security(oauth2_scheme, scopes=[])):
 
 DATA_DIR = Path("dough-data")
 DATA_DIR.mkdir(exist_ok=True)
-MENTAL_STATE_FILE = DATA_DIR / "mental_state.json"
 
 # Check if we have a built frontend to serve
 if FRONTEND_BUILD_DIR.exists() and (FRONTEND_BUILD_DIR / "index.html").exists():
@@ -279,8 +314,6 @@ async def websocket_endpoint(websocket: WebSocket):
     WebSocket endpoint with improved error handling and connection management
     """
 
-    manager = ConnectionManager()
-
     # Accept the WebSocket connection first
     await manager.connect(websocket, "all")
     
@@ -429,31 +462,73 @@ class ConnectionManager:
 
     async def broadcast_json(self, data: dict, group: str = "all"):
         """Broadcast JSON data to all connections in a group"""
-        message = json.dumps(data)
+        message = json.dumps(data, default=str)
         await self.broadcast(message, group)
 
+# Shared by every WebSocket connection so broadcasts reach all clients
+manager = ConnectionManager()
+
+# ============================================================================
+# BROADCAST HELPERS
+# ============================================================================
+
+async def broadcast_fronting_update(fronters_data: dict):
+    """Send the current fronters (with tags and status) to all clients"""
+    snapshot = await get_enriched_members()
+    fronters_data = snapshot.enrich_fronters(fronters_data)
+    
+    await manager.broadcast_json({
+        "type": "fronting_update",
+        "data": fronters_data,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+async def broadcast_members_update(members_data: list):
+    """Send the member list (with tags and status) to all clients"""
+    await manager.broadcast_json({
+        "type": "members_update",
+        "data": {"members": enrich_members(members_data)},
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+async def broadcast_mental_state_update(state_data: dict):
+    """Send the updated mental state to all clients"""
+    await manager.broadcast_json({
+        "type": "mental_state_update",
+        "data": state_data,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+async def broadcast_frontend_update(update_type: str, data: dict):
+    """Send a generic frontend update (e.g. force_refresh) to all clients"""
+    await manager.broadcast_json({
+        "type": update_type,
+        "data": data,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
 # ============================================================================
 # MENTAL STATE API ENDPOINTS
 # ============================================================================
 
+def load_mental_state() -> MentalState:
+    """Get the stored mental state, or the default state if none was set"""
+    state_data = get_document("mental_state")
+    if state_data is None:
+        return MentalState(
+            level="safe",
+            updated_at=datetime.now(timezone.utc),
+            notes=None
+        )
+    # Convert the string back to datetime
+    state_data["updated_at"] = datetime.fromisoformat(state_data["updated_at"])
+    return MentalState(**state_data)
+
 @app.get("/api/mental-state")
 async def get_mental_state():
     """Get current mental state from database"""
     try:
-        # Check if mental_state.json exists
-        if os.path.exists(MENTAL_STATE_FILE):
-            with open(MENTAL_STATE_FILE, "r") as f:
-                state_data = json.load(f)
-                # Convert the string back to datetime
-                state_data["updated_at"] = datetime.fromisoformat(state_data["updated_at"])
-                return MentalState(**state_data)
-        else:
-            # Default state
-            return MentalState(
-                level="safe",
-                updated_at=datetime.now(timezone.utc),
-                notes=None
-            )
+        return load_mental_state()
     except Exception as e:
         print(f"Error loading mental state: {e}")
         return MentalState(
@@ -472,8 +547,7 @@ async def update_mental_state(state: MentalState, user = Depends(get_current_use
         state_data = state.dict()
         state_data["updated_at"] = state_data["updated_at"].isoformat()
         
-        with open(MENTAL_STATE_FILE, "w") as f:
-            json.dump(state_data, f, indent=2)
+        set_document("mental_state", state_data)
         
         # Broadcast the mental state update
         await broadcast_mental_state_update(state_data)
@@ -493,24 +567,10 @@ async def system_info():
         system_data = await get_system()
         
         # Get mental state
-        mental_state_data = None
-        if os.path.exists(MENTAL_STATE_FILE):
-            with open(MENTAL_STATE_FILE, "r") as f:
-                state_data = json.load(f)
-                # Convert the string back to datetime for the response
-                state_data["updated_at"] = datetime.fromisoformat(state_data["updated_at"])
-                mental_state_data = MentalState(**state_data)
-        else:
-            mental_state_data = MentalState(
-                level="safe",
-                updated_at=datetime.now(timezone.utc),
-                notes=None
-            )
-        
-        # Add mental state to system data
-        system_data["mental_state"] = mental_state_data.dict()
+        mental_state_data = load_mental_state()
         
-        return system_data
+        # Add mental state to a copy, the system data is shared with the cache
+        return {**system_data, "mental_state": mental_state_data.dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch system info: {str(e)}")
 
@@ -518,16 +578,9 @@ async def system_info():
 async def members():
     """Get members with tags and status information"""
     try:
-        # Get members
-        members_data = await get_members()
-        
-        # Enrich with tags
-        members_with_tags = enrich_members_with_tags(members_data)
-        
-        # Enrich with status information
-        members_with_status = enrich_members_with_status(members_with_tags)
-        
-        return members_with_status
+        # Members enriched with tags and status, serialized once per change
+        snapshot = await get_enriched_members()
+        return Response(content=snapshot.json, media_type="application/json")
     except HTTPException as http_exc:
         raise http_exc
     except Exception as e:
@@ -538,25 +591,19 @@ async def fronters():
     try:
         fronters_data = await get_fronters()
         
-        # Enrich fronters with tags and status
-        if "members" in fronters_data:
-            members_with_tags = enrich_members_with_tags(fronters_data["members"])
-            fronters_data["members"] = enrich_members_with_status(members_with_tags)
-        
-        return fronters_data
+        # Enrich fronters with tags and status from the member snapshot
+        snapshot = await get_enriched_members()
+        return Response(content=snapshot.fronters_json(fronters_data), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch fronters: {str(e)}")
 
 @app.get("/api/member/{member_id}")
 async def member_detail(member_id: str):
     try:
-        members = await get_members()
-        for member in members:
-            if member["id"] == member_id or member["name"].lower() == member_id.lower():
-                # Enrich with tags and status
-                member_with_tags = enrich_members_with_tags([member])[0]
-                member_with_status = enrich_members_with_status([member_with_tags])[0]
-                return member_with_status
+        snapshot = await get_enriched_members()
+        member = snapshot.find(member_id)
+        if member:
+            return Response(content=snapshot.member_json[member["id"]], media_type="application/json")
         raise HTTPException(status_code=404, detail="Member not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch member details: {str(e)}")
@@ -626,18 +673,17 @@ async def switch_multiple_fronters(
             raise HTTPException(status_code=400, detail="'member_ids' must be a list")
         
         # Get the members to show their names in the response
-        all_members = await get_members()
+        registry = await get_member_registry()
         switching_members = []
         
         for member_id in member_ids:
-            for member in all_members:
-                if member.get("id") == member_id:
-                    switching_members.append({
-                        "id": member.get("id"),
-                        "name": member.get("name"),
-                        "display_name": member.get("display_name", member.get("name"))
-                    })
-                    break
+            member = registry.get(member_id)
+            if member:
+                switching_members.append({
+                    "id": member.get("id"),
+                    "name": member.get("name"),
+                    "display_name": member.get("display_name", member.get("name"))
+                })
         
         # Switch the fronters
         await set_front(member_ids)
@@ -656,6 +702,49 @@ async def switch_multiple_fronters(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============================================================================
+# PLURALKIT WEBHOOK ENDPOINT
+# ============================================================================
+
+async def broadcast_dispatch_changes(changed: Set[str]):
+    """Push fresh data to clients after a PluralKit dispatch event"""
+    try:
+        if "members" in changed:
+            await broadcast_members_update(await get_members())
+        if "fronters" in changed:
+            await broadcast_fronting_update(await get_fronters())
+    except Exception as e:
+        print(f"Error broadcasting PluralKit dispatch changes: {e}")
+
+@app.post("/api/webhooks/pluralkit")
+async def pluralkit_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Receive PluralKit dispatch events and update cached data"""
+    if not is_webhook_configured():
+        raise HTTPException(status_code=503, detail="PluralKit webhook is not configured")
+    
+    try:
+        payload = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    
+    if not isinstance(payload, dict) or not verify_dispatch(payload):
+        raise HTTPException(status_code=401, detail="Invalid signing token")
+    
+    event_type = payload.get("type")
+    
+    # PluralKit sends a PING when the webhook is registered and expects a 200
+    if event_type == "PING":
+        return {"success": True}
+    
+    changed = apply_dispatch_event(payload)
+    print(f"PluralKit dispatch {event_type} for {payload.get('id')}: updated {sorted(changed) or 'nothing'}")
+    
+    # Respond straight away, PluralKit doesn't wait for clients to be notified
+    if changed:
+        background_tasks.add_task(broadcast_dispatch_changes, changed)
+    
+    return {"success": True, "updated": sorted(changed)}
+
 # ============================================================================
 # MEMBER TAGS API ENDPOINTS
 # ============================================================================
@@ -690,10 +779,6 @@ async def update_member_tag_list(
         success = update_member_tags(member_identifier, tags)
         
         if success:
-            # Clear member cache to reflect changes
-            from cache import set_in_cache
-            set_in_cache("members_raw", None, 0)
-            
             return {
                 "status": "success",
                 "message": f"Updated tags for {member_identifier}",
@@ -721,10 +806,6 @@ async def add_single_member_tag(
         success = add_member_tag(member_identifier, tag)
         
         if success:
-            # Clear member cache to reflect changes
-            from cache import set_in_cache
-            set_in_cache("members_raw", None, 0)
-            
             return {
                 "status": "success",
                 "message": f"Added tag '{tag}' to {member_identifier}"
@@ -754,10 +835,6 @@ async def remove_single_member_tag(
         success = remove_member_tag(member_identifier, tag)
         
         if success:
-            # Clear member cache to reflect changes
-            from cache import set_in_cache
-            set_in_cache("members_raw", None, 0)
-            
             return {
                 "status": "success",
                 "message": f"Removed tag '{tag}' from {member_identifier}"
@@ -1035,6 +1112,96 @@ async def switch_frequency_metrics(days: int = 30, user = Depends(get_current_us
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch switch frequency metrics: {str(e)}")
 
+@app.get("/api/metrics/heatmap")
+async def fronting_heatmap(days: int = 30, utc_offset_minutes: int = 0, user = Depends(get_current_user)):
+    """Get seconds fronted per member in each hour of the week (index = weekday * 24 + hour, Monday first)"""
+    if not -14 * 60 <= utc_offset_minutes <= 14 * 60:
+        raise HTTPException(status_code=400, detail="utc_offset_minutes must be between -840 and 840")
+    try:
+        return await get_fronting_heatmap(days, utc_offset_minutes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch fronting heatmap: {str(e)}")
+
+@app.get("/api/metrics/co-fronting")
+async def cofronting_metrics(days: int = 30, limit: int = 50, user = Depends(get_current_user)):
+    """Get time shared by member pairs and the most common fronting sets (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    try:
+        return await get_cofronting_metrics(days, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch co-fronting metrics: {str(e)}")
+
+@app.get("/api/metrics/timeseries")
+async def time_series_metrics(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    bucket: str = "day",
+    user = Depends(get_current_user)
+):
+    """Get fronting seconds per member and switch counts per hour/day/week between two ISO timestamps"""
+    try:
+        return await get_time_series_metrics(start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch time series metrics: {str(e)}")
+
+@app.get("/api/metrics/summary")
+async def metrics_summary(days: int = 30, user = Depends(get_current_user)):
+    """Get fronting time and switch frequency metrics together, computed from the same switch data"""
+    try:
+        return await get_metrics_summary(days)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch metrics summary: {str(e)}")
+
+# ============================================================================
+# EXPORT ENDPOINTS
+# ============================================================================
+
+def _export_response(chunks, export_format: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'}
+    )
+
+@app.get("/api/export/switches")
+async def export_switch_history(
+    format: str = "ndjson",
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    user = Depends(get_current_user)
+):
+    """Stream the switch history as NDJSON or CSV (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        return _export_response(export_switches(format, start, end), format, "switches")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/export/fronting-intervals")
+async def export_member_fronting_intervals(
+    format: str = "ndjson",
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    user = Depends(get_current_user)
+):
+    """Stream continuous fronting intervals per member as NDJSON or CSV (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        return _export_response(await export_fronting_intervals(format, start, end), format, "fronting-intervals")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ============================================================================
 # ADMIN UTILITY ENDPOINTS
 # ============================================================================
@@ -1055,6 +1222,20 @@ async def admin_refresh(user = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to broadcast refresh: {str(e)}")
 
+@app.get("/api/admin/cache")
+async def admin_cache_stats(user = Depends(get_current_user)):
+    """Get cache, request coalescing and HTTP pool statistics (admin only)"""
+    if not user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    
+    return {
+        "cache": get_cache_stats(),
+        "singleflight": get_singleflight_stats(),
+        "rate_limit": get_rate_limit_stats(),
+        "http": get_pool_stats(),
+        "switch_store": switch_store.stats()
+    }
+
 # ============================================================================
 # MEMBER STATUS ENDPOINTS
 # ============================================================================
@@ -1365,13 +1546,8 @@ async def serve_member_page(member_name: str, request: Request):
                 .replace("'", '&#x27;'))
     
     try:
-        members = await get_members()
-        member = None
-        
-        for m in members:
-            if m.get("name", "").lower() == member_name.lower():
-                member = m
-                break
+        registry = await get_member_registry()
+        member = registry.get_by_name(member_name)
         
         if not member:
             return FileResponse(STATIC_DIR / "index.html")
@@ -0,0 +1,60 @@
+import json
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def compute_members_version(members: List[Dict[str, Any]]) -> int:
+    """Content hash of a member list, so identical data always gets the same version in every worker"""
+    encoded = json.dumps(members, sort_keys=True, separators=(",", ":"), default=str)
+    return zlib.crc32(encoded.encode("utf-8"))
+
+
+class MemberRegistry:
+    """
+    Processed member list indexed by id, lowercase name and lowercase display name.
+
+    Built once per member refresh, so lookups on hot paths are O(1) instead of
+    a scan over every member. `version` changes whenever the member data does
+    and can be used as part of other cache keys.
+    """
+
+    def __init__(self, members: List[Dict[str, Any]], version: Optional[int] = None):
+        self.members = members
+        self.version = version if version is not None else compute_members_version(members)
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_display_name: Dict[str, Dict[str, Any]] = {}
+
+        # The first member wins on duplicate names, same as the old linear scans
+        for member in members:
+            if member.get("id"):
+                self.by_id.setdefault(member["id"], member)
+            if member.get("name"):
+                self.by_name.setdefault(member["name"].lower(), member)
+            if member.get("display_name"):
+                self.by_display_name.setdefault(member["display_name"].lower(), member)
+
+    def get(self, member_id: str) -> Optional[Dict[str, Any]]:
+        """Get a member by id"""
+        return self.by_id.get(member_id)
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get a member by name (case-insensitive)"""
+        return self.by_name.get(name.lower())
+
+    def get_by_display_name(self, display_name: str) -> Optional[Dict[str, Any]]:
+        """Get a member by display name (case-insensitive)"""
+        return self.by_display_name.get(display_name.lower())
+
+    def find(self, identifier: str) -> Optional[Dict[str, Any]]:
+        """Get a member by id, falling back to name (case-insensitive)"""
+        return self.by_id.get(identifier) or self.by_name.get(identifier.lower())
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.members)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __contains__(self, member_id: str) -> bool:
+        return member_id in self.by_id
@@ -1,33 +1,19 @@
-import json
-import os
-from typing import Optional, Dict, List
+from typing import Optional, Dict
 from datetime import datetime, timezone
-from pathlib import Path
 
-# Define data directory
-DATA_DIR = Path("dough-data")
-MEMBER_STATUS_FILE = DATA_DIR / "member_status.json"
-
-# Ensure data directory exists
-DATA_DIR.mkdir(exist_ok=True)
+from storage import get_collection
 
 def get_all_statuses() -> Dict[str, Dict]:
     """Get all member statuses"""
-    if not os.path.exists(MEMBER_STATUS_FILE):
-        return {}
-    
-    with open(MEMBER_STATUS_FILE, "r") as f:
-        return json.load(f)
+    return get_collection("member_status").get_all()
 
 def save_all_statuses(statuses: Dict[str, Dict]):
-    """Save all member statuses to file"""
-    with open(MEMBER_STATUS_FILE, "w") as f:
-        json.dump(statuses, f, indent=2)
+    """Replace all member statuses"""
+    get_collection("member_status").replace_all(statuses)
 
 def get_member_status(member_identifier: str) -> Optional[Dict]:
     """Get status for a specific member by ID or name"""
-    statuses = get_all_statuses()
-    return statuses.get(member_identifier)
+    return get_collection("member_status").get(member_identifier)
 
 def set_member_status(member_identifier: str, status_text: str, emoji: Optional[str] = None) -> Dict:
     """
@@ -41,16 +27,13 @@ def set_member_status(member_identifier: str, status_text: str, emoji: Optional[
     Returns:
         The created/updated status object
     """
-    statuses = get_all_statuses()
-    
     status_obj = {
         "text": status_text,
         "emoji": emoji,
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    statuses[member_identifier] = status_obj
-    save_all_statuses(statuses)
+    get_collection("member_status").put(member_identifier, status_obj)
     
     return status_obj
 
@@ -61,54 +44,26 @@ def clear_member_status(member_identifier: str) -> bool:
     Returns:
         True if status was found and removed, False otherwise
     """
-    statuses = get_all_statuses()
-    
-    if member_identifier in statuses:
-        del statuses[member_identifier]
-        save_all_statuses(statuses)
-        return True
-    
-    return False
+    return get_collection("member_status").delete(member_identifier)
 
-def enrich_member_with_status(member: Dict) -> Dict:
-    """
-    Add status information to a member object
-    
-    Args:
-        member: Member dictionary to enrich
-    
-    Returns:
-        Member dictionary with status field added
-    """
+def get_statuses_snapshot() -> Dict[str, Dict]:
+    """Get all member statuses from memory, reloaded when they change (must not be modified)"""
+    return get_collection("member_status").snapshot()
+
+def lookup_member_status(statuses: Dict[str, Dict], member: Dict) -> Optional[Dict]:
+    """Find a member's status in a status dict, by ID first and then by name"""
     member_id = member.get("id")
     member_name = member.get("name")
     
-    # Try to find status by ID first, then by name
     status = None
     if member_id:
-        status = get_member_status(str(member_id))
+        status = statuses.get(str(member_id))
     if not status and member_name:
-        status = get_member_status(member_name)
-    
-    return {
-        **member,
-        "status": status
-    }
-
-def enrich_members_with_status(members: List[Dict]) -> List[Dict]:
-    """
-    Add status information to a list of members
-    
-    Args:
-        members: List of member dictionaries
-    
-    Returns:
-        List of member dictionaries with status fields added
-    """
-    return [enrich_member_with_status(member) for member in members]
+        status = statuses.get(member_name)
+    return status
 
 def initialize_status_storage():
-    """Initialize the status storage file if it doesn't exist"""
-    if not os.path.exists(MEMBER_STATUS_FILE):
+    """Initialize the status storage if it doesn't exist"""
+    if not get_collection("member_status").exists():
         save_all_statuses({})
         print("Initialized member status storage")
\ No newline at end of file
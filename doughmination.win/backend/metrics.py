@@ -1,21 +1,25 @@
 from datetime import datetime, timedelta, timezone
-import httpx
+from functools import lru_cache
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 from cache import get_from_cache, set_in_cache
-from typing import List, Dict, Any, Optional
+from singleflight import SingleFlight
+from switch_store import switch_store
+from metrics_engine import (
+    BUCKET_SIZES, EPOCH, TIMEFRAMES, US_PER_SECOND, bucket_count, bucket_edges, compute_cofronting, compute_heatmap,
+    compute_time_series, datetime_to_us, get_switch_history
+)
+from metrics_rolling import get_rolling_fronting
+from typing import Dict, Any, Awaitable, Callable, Optional
 import traceback
 import re
 
 load_dotenv()
 
-BASE_URL = "https://api.pluralkit.me/v2"
-TOKEN = os.getenv("SYSTEM_TOKEN")
-CACHE_TTL = int(os.getenv("CACHE_TTL", 30))
-
-HEADERS = {
-    "Authorization": TOKEN
-}
+# How many parsed switch timestamps to memoize
+TIMESTAMP_CACHE_SIZE = int(os.getenv("TIMESTAMP_CACHE_SIZE", 65536))
 
 def parse_timestamp(timestamp_str: str) -> datetime:
     """Parse timestamp string into datetime with proper timezone handling"""
@@ -58,297 +62,513 @@ def parse_timestamp(timestamp_str: str) -> datetime:
         print(f"Error parsing timestamp {timestamp_str}: {str(e)}")
         raise
 
-async def get_switches(limit: int = 1000) -> List[Dict[str, Any]]:
-    """Get recent switches from PluralKit"""
+def _parse_timestamp_us_fast(timestamp_str: str) -> Optional[int]:
+    """
+    Parse PluralKit's ISO-8601 timestamps straight to epoch microseconds.
+
+    On Python 3.11+ the C fromisoformat accepts PluralKit's format as is
+    ("Z" suffix, any number of fraction digits), so only the conversion to
+    microseconds is left, in integer arithmetic. Returns None for anything it
+    can't handle (including naive timestamps) so the caller can fall back to
+    parse_timestamp.
+    """
     try:
-        cache_key = f"switches_{limit}"
-        if (cached := get_from_cache(cache_key)):
-            return cached
-        
-        print(f"Fetching switches from PluralKit API, limit={limit}")
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"{BASE_URL}/systems/@me/switches?limit={limit}", headers=HEADERS)
-            resp.raise_for_status()
-            data = resp.json()
-            print(f"Received {len(data)} switches from API")
-            set_in_cache(cache_key, data, CACHE_TTL)
-            return data
+        delta = datetime.fromisoformat(timestamp_str) - EPOCH
+    except (ValueError, TypeError):
+        return None
+    return (delta.days * 86400 + delta.seconds) * US_PER_SECOND + delta.microseconds
+
+def parse_timestamp_us(timestamp_str: str) -> int:
+    """Parse a timestamp string to epoch microseconds, falling back to parse_timestamp for unusual formats"""
+    us = _parse_timestamp_us_fast(timestamp_str)
+    if us is None:
+        us = datetime_to_us(parse_timestamp(timestamp_str))
+    return us
+
+# Switch timestamps never change, so parsed values are memoized by the raw string
+timestamp_to_us = lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)(parse_timestamp_us)
+
+def us_to_isoformat(us: int) -> str:
+    return (EPOCH + timedelta(microseconds=us)).isoformat()
+
+# ============================================================================
+# METRICS PIPELINE
+# ============================================================================
+
+class MetricsContext:
+    """
+    Inputs shared by every metric for one request: the period and the switch columns.
+
+    The columns come from the shared switch history, which only loads switches
+    again when the switch store's version changes, so computing several
+    metrics for a request (or several requests) reuses the same parsed data.
+    """
+
+    def __init__(self, days: int, now: Optional[datetime] = None):
+        self.days = days
+        self.now = now or datetime.now(timezone.utc)
+        self.cutoff_time = self.now - timedelta(days=days)
+        self.now_us = datetime_to_us(self.now)
+        self.cutoff_us = datetime_to_us(self.cutoff_time)
+        self.columns = get_switch_history().refresh()
+
+        if not switch_store.backfill_complete:
+            print(f"Switch history backfill still running, {len(self.columns)} switches loaded so far")
+
+def _empty_fronting_metrics() -> Dict[str, Any]:
+    return {
+        "total_time": 0,
+        "members": {},
+        "timeframes": {name: {} for name, _ in TIMEFRAMES}
+    }
+
+def _empty_frequency_metrics() -> Dict[str, Any]:
+    return {
+        "total_switches": 0,
+        "avg_switches_per_day": 0,
+        "timeframes": {name: 0 for name, _ in TIMEFRAMES}
+    }
+
+async def get_member_details() -> Dict[str, Dict[str, Any]]:
+    """Get names and avatars by member id, for display purposes"""
+    member_details = {}
+    try:
+        from pluralkit import get_members
+        members = await get_members()
+        print(f"Retrieved {len(members)} members for details")
+        for member in members:
+            member_details[member["id"]] = {
+                "name": member["name"],
+                "display_name": member.get("display_name", member["name"]),
+                "avatar_url": member.get("avatar_url", None)
+            }
     except Exception as e:
-        print(f"Error in get_switches: {str(e)}")
+        print(f"Error fetching member details: {e}")
         print(traceback.format_exc())
-        # Return empty list instead of failing
-        return []
+    return member_details
 
-async def get_fronting_time_metrics(days: int = 30) -> Dict[str, Any]:
-    """Calculate fronting time metrics for each member"""
+def compute_fronting_time(context: MetricsContext, member_details: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Fronting time per member for the context's period and every timeframe"""
+    # Read the rolling aggregates, which catch up with new switches first
+    totals = get_rolling_fronting().totals(context.now_us, context.days * 24 * 3600)
+
+    # If there are no switches in the period, return empty metrics
+    if totals is None:
+        print("No switches found in the specified time period")
+        return _empty_fronting_metrics()
+
+    total_time_seconds = totals.total_us / US_PER_SECOND
+    result = _empty_fronting_metrics()
+    result["total_time"] = total_time_seconds
+
+    for k, member_id in enumerate(totals.member_ids):
+        times = {name: totals.windows[name][k] / US_PER_SECOND for name, _ in TIMEFRAMES}
+        total_seconds = totals.period_us[k] / US_PER_SECOND
+
+        # Get member name and other details
+        details = member_details.get(member_id, {})
+
+        # Calculate percentages
+        total_percent = (total_seconds / total_time_seconds) * 100 if total_time_seconds > 0 else 0
+
+        result["members"][member_id] = {
+            "id": member_id,
+            "name": details.get("name", member_id),
+            "display_name": details.get("display_name", member_id),
+            "avatar_url": details.get("avatar_url"),
+            "total_seconds": total_seconds,
+            "total_percent": total_percent,
+            **times
+        }
+
+        # Add to timeframes for easier processing
+        for name, _ in TIMEFRAMES:
+            result["timeframes"][name][member_id] = times[name]
+
+    print(f"Successfully calculated metrics for {len(result['members'])} members")
+    return result
+
+def compute_switch_frequency(context: MetricsContext) -> Dict[str, Any]:
+    """Switch counts for the context's period and every timeframe, by bisecting the sorted timestamps"""
+    columns = context.columns
+    total_switches = len(columns) - columns.first_at_or_after(context.cutoff_us)
+
+    timeframes = {}
+    for name, seconds in TIMEFRAMES:
+        if name == "30d":
+            # Reported as the whole period, whatever `days` is
+            timeframes[name] = total_switches
+            continue
+        edge_us = max(context.cutoff_us, context.now_us - seconds * US_PER_SECOND)
+        timeframes[name] = len(columns) - columns.first_at_or_after(edge_us)
+
+    # Calculate average switches per day
+    avg_switches_per_day = total_switches / context.days if context.days > 0 else 0
+
+    return {
+        "total_switches": total_switches,
+        "avg_switches_per_day": avg_switches_per_day,
+        "timeframes": timeframes
+    }
+
+def compute_fronting_heatmap(context: MetricsContext, member_details: Dict[str, Dict[str, Any]],
+                             utc_offset_minutes: int = 0) -> Dict[str, Any]:
+    """
+    Seconds fronted per member in each hour of the week over the context's period.
+
+    `hours[day * 24 + hour]` is for that hour of the day on that weekday
+    (0 = Monday), in UTC shifted by utc_offset_minutes. Unlike the fronting
+    time metrics, time is clipped to the period, so the switch that was
+    fronting when the period started counts too.
+    """
+    member_ids, matrix = compute_heatmap(
+        context.columns, context.cutoff_us, context.now_us, context.now_us,
+        utc_offset_minutes * 60 * US_PER_SECOND,
+    )
+    result = {
+        "days": context.days,
+        "start": context.cutoff_time.isoformat(),
+        "end": context.now.isoformat(),
+        "utc_offset_minutes": utc_offset_minutes,
+        "bucket_seconds": 3600,
+        "members": {}
+    }
+    for member_id, buckets in zip(member_ids, matrix):
+        details = member_details.get(member_id, {})
+        result["members"][member_id] = {
+            "id": member_id,
+            "name": details.get("name", member_id),
+            "display_name": details.get("display_name", member_id),
+            "avatar_url": details.get("avatar_url"),
+            "total_seconds": sum(buckets) / US_PER_SECOND,
+            "hours": [value / US_PER_SECOND for value in buckets]
+        }
+    return result
+
+def compute_cofronting_metrics(context: MetricsContext, member_details: Dict[str, Dict[str, Any]],
+                               limit: int = 50) -> Dict[str, Any]:
+    """Time members shared the front over the context's period: top member pairs and fronting sets"""
+    cofronting = compute_cofronting(context.columns, context.cutoff_us, context.now_us, context.now_us)
+    member_ids = context.columns.member_ids
+    total_seconds = cofronting.total_us / US_PER_SECOND
+
+    def percent(us: int) -> float:
+        return (us / cofronting.total_us) * 100 if cofronting.total_us > 0 else 0
+
+    top_pairs = sorted(cofronting.pairs.items(), key=lambda item: item[1], reverse=True)[:limit]
+    top_sets = sorted(cofronting.sets.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+
+    # Names for every member mentioned, so the client doesn't need another request
+    mentioned = {member_ids[idx] for pair, _ in top_pairs for idx in pair}
+    mentioned.update(member_ids[idx] for key, _ in top_sets for idx in key)
+    members = {}
+    for member_id in mentioned:
+        details = member_details.get(member_id, {})
+        members[member_id] = {
+            "id": member_id,
+            "name": details.get("name", member_id),
+            "display_name": details.get("display_name", member_id),
+            "avatar_url": details.get("avatar_url")
+        }
+
+    return {
+        "days": context.days,
+        "start": context.cutoff_time.isoformat(),
+        "end": context.now.isoformat(),
+        "total_seconds": total_seconds,
+        "pair_count": len(cofronting.pairs),
+        "fronting_set_count": len(cofronting.sets),
+        "pairs": [
+            {"members": [member_ids[a], member_ids[b]], "seconds": us / US_PER_SECOND, "percent": percent(us)}
+            for (a, b), us in top_pairs
+        ],
+        "fronting_sets": [
+            {"members": [member_ids[idx] for idx in key], "seconds": us / US_PER_SECOND,
+             "percent": percent(us), "switches": switches}
+            for key, (us, switches) in top_sets
+        ],
+        "members": members
+    }
+
+# Range used by time series queries without `from`
+TIME_SERIES_DEFAULT_DAYS = 30
+TIME_SERIES_MAX_BUCKETS = 2000
+
+def check_time_series_range(start_us: int, end_us: int, bucket: str):
+    """Raise ValueError for empty ranges, unknown bucket sizes and ranges that need too many buckets"""
+    if end_us <= start_us:
+        raise ValueError("'to' must be after 'from'")
+    if bucket not in BUCKET_SIZES:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKET_SIZES)}")
+    # Counted arithmetically, so huge ranges are rejected before any list is built
+    count = bucket_count(start_us, end_us, bucket)
+    if count > TIME_SERIES_MAX_BUCKETS:
+        raise ValueError(f"Too many buckets ({count}), use a larger bucket or a shorter range")
+
+def compute_time_series_metrics(context: MetricsContext, member_details: Dict[str, Dict[str, Any]],
+                                start_us: Optional[int], end_us: Optional[int], bucket: str) -> Dict[str, Any]:
+    """
+    Seconds fronted per member and switch counts per hour, day or week bucket.
+
+    The range defaults to the context's period. Buckets are aligned to UTC
+    hours, days or weeks (starting Monday), and only time within the range is
+    counted, so the first and last buckets can be partial.
+    """
+    start_us = context.cutoff_us if start_us is None else start_us
+    end_us = context.now_us if end_us is None else end_us
+    check_time_series_range(start_us, end_us, bucket)
+    edges = bucket_edges(start_us, end_us, bucket)
+
+    member_ids, matrix, counts = compute_time_series(context.columns, start_us, end_us, context.now_us, edges)
+    result = {
+        "from": us_to_isoformat(start_us),
+        "to": us_to_isoformat(end_us),
+        "bucket": bucket,
+        "buckets": [us_to_isoformat(edge) for edge in edges[:-1]],
+        "switch_counts": counts,
+        "members": {}
+    }
+    for member_id, values in zip(member_ids, matrix):
+        details = member_details.get(member_id, {})
+        result["members"][member_id] = {
+            "id": member_id,
+            "name": details.get("name", member_id),
+            "display_name": details.get("display_name", member_id),
+            "avatar_url": details.get("avatar_url"),
+            "total_seconds": sum(values) / US_PER_SECOND,
+            "seconds": [value / US_PER_SECOND for value in values]
+        }
+    return result
+
+async def _fronting_time_metrics(days: int, context: Optional[MetricsContext] = None) -> Dict[str, Any]:
+    print(f"Calculating fronting metrics for past {days} days")
+    member_details = await get_member_details()
+    context = context or MetricsContext(days)
+    print(f"Cutoff time: {context.cutoff_time.isoformat()}")
+    return compute_fronting_time(context, member_details)
+
+async def _switch_frequency_metrics(days: int, context: Optional[MetricsContext] = None) -> Dict[str, Any]:
+    return compute_switch_frequency(context or MetricsContext(days))
+
+async def _cofronting_metrics(days: int, limit: int) -> Dict[str, Any]:
+    member_details = await get_member_details()
+    return compute_cofronting_metrics(MetricsContext(days), member_details, limit)
+
+async def _time_series_metrics(start_us: Optional[int], end_us: Optional[int], bucket: str) -> Dict[str, Any]:
+    member_details = await get_member_details()
+    context = MetricsContext(TIME_SERIES_DEFAULT_DAYS)
+    return compute_time_series_metrics(context, member_details, start_us, end_us, bucket)
+
+async def _fronting_heatmap(days: int, utc_offset_minutes: int) -> Dict[str, Any]:
+    member_details = await get_member_details()
+    return compute_fronting_heatmap(MetricsContext(days), member_details, utc_offset_minutes)
+
+# ============================================================================
+# RESULT CACHE
+# ============================================================================
+
+# Precompute the dashboard's default view in the background after every switch
+METRICS_PRECOMPUTE = os.getenv("METRICS_PRECOMPUTE", "true").lower() in ("1", "true", "yes")
+METRICS_PRECOMPUTE_DAYS = int(os.getenv("METRICS_PRECOMPUTE_DAYS", 30))
+
+# Keys change with every switch and every minute, so only the totals are counted
+metrics_flight = SingleFlight("metrics", per_key_stats=False)
+
+# Results that precompute_metrics() keeps up to date
+PRECOMPUTED_KINDS = ("fronting", "frequency")
+
+def _is_precomputed(kind: str, period: Any) -> bool:
+    """Whether the precompute task is keeping this result up to date right now"""
+    return (
+        METRICS_PRECOMPUTE and kind in PRECOMPUTED_KINDS and period == METRICS_PRECOMPUTE_DAYS
+        and _ticker_task is not None and not _ticker_task.done()
+        and switch_store.backfill_complete
+    )
+
+async def _metrics_cache_key(kind: str, period: Any) -> Optional[str]:
+    """
+    Cache key for a metrics result, which only depends on the period (days, or
+    the query's range parameters), the switch history, the member data and the
+    current minute. Returns None if the member data can't be loaded, so results
+    without member names aren't cached.
+
+    Precomputed results leave the minute out while the precompute task is
+    running: it rewrites them every minute, so they stay current without
+    requests ever missing.
+    """
     try:
-        print(f"Calculating fronting metrics for past {days} days")
-        # Get all switches for the specified period
-        switches = await get_switches(1000)  # Get a large number of switches
-        print(f"Retrieved {len(switches)} switches")
-        
-        # Get current time and calculate the cutoff time
-        now = datetime.now(timezone.utc)
-        cutoff_time = now - timedelta(days=days)
-        print(f"Cutoff time: {cutoff_time.isoformat()}")
-        
-        # Get member details for display purposes
-        member_details = {}
+        from pluralkit import get_member_registry
+        registry_version = (await get_member_registry()).version
+    except Exception as e:
+        print(f"Error loading members for the metrics cache key: {e}")
+        return None
+    key = f"metrics_{kind}_{period}_{switch_store.version}_{registry_version}"
+    if _is_precomputed(kind, period):
+        return key
+    return f"{key}_{int(time.time() // 60)}"
+
+async def _cached_metrics(kind: str, period: Any, compute: Callable[[], Awaitable[Dict[str, Any]]],
+                          refresh: bool = False) -> Dict[str, Any]:
+    """
+    Get a metrics result from the cache, computing it once (across concurrent requests) on a miss.
+
+    With refresh, the result is computed and stored even if it is cached.
+    """
+    key = await _metrics_cache_key(kind, period)
+    if key is None:
+        return await compute()
+    if not refresh:
+        cached = get_from_cache(key)
+        if cached is not None:
+            return cached
+
+    async def compute_and_store():
+        from pluralkit import TAG_MEMBERS, TAG_SWITCHES
+        result = await compute()
+        # Tagged so switch and member invalidations drop stale results right away
+        set_in_cache(key, result, tags=(TAG_SWITCHES, TAG_MEMBERS))
+        return result
+
+    return await metrics_flight.do(key, compute_and_store)
+
+async def precompute_metrics(days: int = METRICS_PRECOMPUTE_DAYS):
+    """Compute and cache every metric for a period from one shared context"""
+    shared: Optional[MetricsContext] = None
+
+    def context() -> MetricsContext:
+        # Created on first use, after the member data is loaded, so waiting behind
+        # other PluralKit requests can't leave its "now" in the past
+        nonlocal shared
+        if shared is None:
+            shared = MetricsContext(days)
+        return shared
+
+    async def fronting() -> Dict[str, Any]:
+        member_details = await get_member_details()
+        return compute_fronting_time(context(), member_details)
+
+    async def frequency() -> Dict[str, Any]:
+        return compute_switch_frequency(context())
+
+    await _cached_metrics("fronting", days, fronting, refresh=True)
+    await _cached_metrics("frequency", days, frequency, refresh=True)
+
+_precompute_task: Optional[asyncio.Task] = None
+_precompute_again = False
+
+async def _precompute_loop():
+    global _precompute_again
+    from pluralkit import PRIORITY_BACKGROUND, _request_priority
+    _request_priority.set(PRIORITY_BACKGROUND)
+    while True:
+        _precompute_again = False
+        # Let the change that scheduled us finish first
+        await asyncio.sleep(0)
         try:
-            from pluralkit import get_members
-            members = await get_members()
-            print(f"Retrieved {len(members)} members for details")
-            for member in members:
-                member_details[member["id"]] = {
-                    "name": member["name"],
-                    "display_name": member.get("display_name", member["name"]),
-                    "avatar_url": member.get("avatar_url", None)
-                }
+            await precompute_metrics()
         except Exception as e:
-            print(f"Error fetching member details: {e}")
-            print(traceback.format_exc())
-        
-        # Filter switches to only include those within the specified period
-        filtered_switches = []
-        for switch in switches:
-            try:
-                timestamp = parse_timestamp(switch["timestamp"])
-                if timestamp >= cutoff_time:
-                    filtered_switches.append({
-                        **switch,
-                        "_parsed_timestamp": timestamp  # Store the parsed timestamp
-                    })
-            except Exception as e:
-                print(f"Error parsing timestamp {switch.get('timestamp', 'unknown')}: {str(e)}")
-                continue
-        
-        print(f"Filtered to {len(filtered_switches)} switches within time period")
-        
-        # Sort switches by timestamp (oldest first)
-        filtered_switches.sort(key=lambda x: x["_parsed_timestamp"])
-        
-        # Calculate fronting time for each member
-        fronting_times = {}
-        
-        # If there are no switches in the period, return empty metrics
-        if not filtered_switches:
-            print("No switches found in the specified time period")
-            return {
-                "total_time": 0,
-                "members": {},
-                "timeframes": {
-                    "24h": {},
-                    "48h": {},
-                    "5d": {},
-                    "7d": {},
-                    "30d": {}
-                }
-            }
-        
-        # Add a virtual "current" switch to include time up to now
-        current_members = filtered_switches[-1]["members"]
-        filtered_switches.append({
-            "timestamp": now.isoformat(),
-            "members": current_members,
-            "_parsed_timestamp": now
-        })
-        
-        # Calculate total time for each member
-        total_time_seconds = 0
-        for i in range(1, len(filtered_switches)):
-            prev_switch = filtered_switches[i-1]
-            curr_switch = filtered_switches[i]
-            
-            try:
-                # Use the parsed timestamps
-                prev_time = prev_switch["_parsed_timestamp"]
-                curr_time = curr_switch["_parsed_timestamp"]
-                
-                # Calculate duration in seconds
-                duration_seconds = (curr_time - prev_time).total_seconds()
-                total_time_seconds += duration_seconds
-                
-                # Add duration to each member that was fronting
-                for member_id in prev_switch["members"]:
-                    if member_id not in fronting_times:
-                        fronting_times[member_id] = {
-                            "total_seconds": 0,
-                            "24h": 0,
-                            "48h": 0,
-                            "5d": 0,
-                            "7d": 0,
-                            "30d": 0
-                        }
-                    
-                    fronting_times[member_id]["total_seconds"] += duration_seconds
-                    
-                    # Check which timeframes this duration falls into
-                    time_ago = (now - prev_time).total_seconds()
-                    
-                    if time_ago <= 24 * 3600:  # 24 hours
-                        fronting_times[member_id]["24h"] += duration_seconds
-                    
-                    if time_ago <= 48 * 3600:  # 48 hours
-                        fronting_times[member_id]["48h"] += duration_seconds
-                    
-                    if time_ago <= 5 * 24 * 3600:  # 5 days
-                        fronting_times[member_id]["5d"] += duration_seconds
-                    
-                    if time_ago <= 7 * 24 * 3600:  # 7 days
-                        fronting_times[member_id]["7d"] += duration_seconds
-                    
-                    if time_ago <= 30 * 24 * 3600:  # 30 days
-                        fronting_times[member_id]["30d"] += duration_seconds
-            except Exception as e:
-                print(f"Error processing switch {i}: {str(e)}")
-                print(f"Previous switch timestamp: {prev_switch.get('timestamp', 'unknown')}")
-                print(f"Current switch timestamp: {curr_switch.get('timestamp', 'unknown')}")
-                print(traceback.format_exc())
-                continue
-        
-        # Format the result
-        result = {
-            "total_time": total_time_seconds,
-            "members": {},
-            "timeframes": {
-                "24h": {},
-                "48h": {},
-                "5d": {},
-                "7d": {},
-                "30d": {}
-            }
-        }
-        
-        for member_id, times in fronting_times.items():
-            # Get member name and other details
-            name = member_id
-            display_name = member_id
-            avatar_url = None
-            
-            if member_id in member_details:
-                name = member_details[member_id]["name"]
-                display_name = member_details[member_id]["display_name"]
-                avatar_url = member_details[member_id]["avatar_url"]
-            
-            # Calculate percentages
-            total_percent = (times["total_seconds"] / total_time_seconds) * 100 if total_time_seconds > 0 else 0
-            
-            # Add to result
-            result["members"][member_id] = {
-                "id": member_id,
-                "name": name,
-                "display_name": display_name,
-                "avatar_url": avatar_url,
-                "total_seconds": times["total_seconds"],
-                "total_percent": total_percent,
-                "24h": times["24h"],
-                "48h": times["48h"],
-                "5d": times["5d"],
-                "7d": times["7d"],
-                "30d": times["30d"]
-            }
-            
-            # Add to timeframes for easier processing
-            result["timeframes"]["24h"][member_id] = times["24h"]
-            result["timeframes"]["48h"][member_id] = times["48h"]
-            result["timeframes"]["5d"][member_id] = times["5d"]
-            result["timeframes"]["7d"][member_id] = times["7d"]
-            result["timeframes"]["30d"][member_id] = times["30d"]
-        
-        print(f"Successfully calculated metrics for {len(result['members'])} members")
-        return result
+            print(f"Error precomputing metrics: {e}")
+        if not _precompute_again:
+            return
+
+def schedule_metrics_precompute():
+    """Switch store listener: recompute the default metrics view soon, coalescing bursts of changes"""
+    global _precompute_task, _precompute_again
+    # Every backfill page rewrites the history, so wait until it's done
+    if not METRICS_PRECOMPUTE or not switch_store.backfill_complete:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # not running in the app (e.g. a script)
+    if _precompute_task is not None and not _precompute_task.done():
+        _precompute_again = True
+        return
+    _precompute_task = loop.create_task(_precompute_loop())
+
+switch_store.add_listener(schedule_metrics_precompute)
+
+_ticker_task: Optional[asyncio.Task] = None
+
+async def _precompute_ticker():
+    # Fronting time and the timeframes move with the clock, so refresh at every minute boundary
+    while True:
+        await asyncio.sleep(60 - time.time() % 60)
+        schedule_metrics_precompute()
+
+def start_metrics_precompute():
+    """Precompute the default metrics view now and then every minute"""
+    global _ticker_task
+    if not METRICS_PRECOMPUTE or _ticker_task is not None:
+        return
+    schedule_metrics_precompute()
+    _ticker_task = asyncio.create_task(_precompute_ticker())
+
+async def stop_metrics_precompute():
+    global _ticker_task
+    if _ticker_task is not None:
+        _ticker_task.cancel()
+        try:
+            await _ticker_task
+        except asyncio.CancelledError:
+            pass
+        _ticker_task = None
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+async def get_fronting_time_metrics(days: int = 30) -> Dict[str, Any]:
+    """Calculate fronting time metrics for each member"""
+    try:
+        return await _cached_metrics("fronting", days, lambda: _fronting_time_metrics(days))
     except Exception as e:
         print(f"Error in get_fronting_time_metrics: {str(e)}")
         print(traceback.format_exc())
         # Return a basic structure so the frontend doesn't crash
-        return {
-            "total_time": 0,
-            "members": {},
-            "timeframes": {
-                "24h": {},
-                "48h": {},
-                "5d": {},
-                "7d": {},
-                "30d": {}
-            }
-        }
+        return _empty_fronting_metrics()
 
 async def get_switch_frequency_metrics(days: int = 30) -> Dict[str, Any]:
     """Calculate switch frequency metrics"""
     try:
-        # Get all switches for the specified period
-        switches = await get_switches(1000)  # Get a large number of switches
-        
-        # Get current time and calculate the cutoff time
-        now = datetime.now(timezone.utc)
-        cutoff_time = now - timedelta(days=days)
-        
-        # Filter switches to only include those within the specified period
-        filtered_switches = []
-        for switch in switches:
-            try:
-                timestamp = parse_timestamp(switch["timestamp"])
-                if timestamp >= cutoff_time:
-                    filtered_switches.append({
-                        **switch,
-                        "_parsed_timestamp": timestamp
-                    })
-            except Exception as e:
-                print(f"Error parsing timestamp in switch_frequency: {str(e)}")
-                continue
-        
-        # Calculate metrics
-        total_switches = len(filtered_switches)
-        
-        # Calculate switches per day for the last specified days
-        timeframes = {
-            "24h": 0,
-            "48h": 0,
-            "5d": 0,
-            "7d": 0,
-            "30d": total_switches
-        }
-        
-        for switch in filtered_switches:
-            try:
-                timestamp = switch["_parsed_timestamp"]
-                time_ago = (now - timestamp).total_seconds()
-                
-                if time_ago <= 24 * 3600:  # 24 hours
-                    timeframes["24h"] += 1
-                
-                if time_ago <= 48 * 3600:  # 48 hours
-                    timeframes["48h"] += 1
-                
-                if time_ago <= 5 * 24 * 3600:  # 5 days
-                    timeframes["5d"] += 1
-                
-                if time_ago <= 7 * 24 * 3600:  # 7 days
-                    timeframes["7d"] += 1
-            except Exception as e:
-                print(f"Error calculating timeframes: {str(e)}")
-                continue
-        
-        # Calculate average switches per day
-        avg_switches_per_day = total_switches / days if days > 0 else 0
-        
-        return {
-            "total_switches": total_switches,
-            "avg_switches_per_day": avg_switches_per_day,
-            "timeframes": timeframes
-        }
+        return await _cached_metrics("frequency", days, lambda: _switch_frequency_metrics(days))
     except Exception as e:
         print(f"Error in get_switch_frequency_metrics: {str(e)}")
         print(traceback.format_exc())
         # Return basic structure
-        return {
-            "total_switches": 0,
-            "avg_switches_per_day": 0,
-            "timeframes": {
-                "24h": 0,
-                "48h": 0,
-                "5d": 0,
-                "7d": 0,
-                "30d": 0
-            }
-        }
\ No newline at end of file
+        return _empty_frequency_metrics()
+
+async def get_fronting_heatmap(days: int = 30, utc_offset_minutes: int = 0) -> Dict[str, Any]:
+    """Calculate the weekly fronting heatmap for each member"""
+    return await _cached_metrics(
+        f"heatmap{utc_offset_minutes}", days, lambda: _fronting_heatmap(days, utc_offset_minutes)
+    )
+
+async def get_cofronting_metrics(days: int = 30, limit: int = 50) -> Dict[str, Any]:
+    """Calculate which members front together and for how long"""
+    return await _cached_metrics(f"cofronting{limit}", days, lambda: _cofronting_metrics(days, limit))
+
+async def get_time_series_metrics(start: Optional[str] = None, end: Optional[str] = None,
+                                  bucket: str = "day") -> Dict[str, Any]:
+    """
+    Calculate fronting seconds per member and switch counts per bucket between two timestamps.
+
+    Raises ValueError for unparseable timestamps, unknown bucket sizes and
+    ranges that are empty or need too many buckets.
+    """
+    start_us = timestamp_to_us(start) if start else None
+    end_us = timestamp_to_us(end) if end else None
+    if start_us is not None and end_us is not None:
+        # Reject bad ranges before building a context or taking a cache slot
+        check_time_series_range(start_us, end_us, bucket)
+    # Without an explicit end the range moves with the clock, which the cache key's minute covers
+    period = f"{bucket}_{start_us if start_us is not None else 'default'}_{end_us if end_us is not None else 'now'}"
+    return await _cached_metrics("series", period, lambda: _time_series_metrics(start_us, end_us, bucket))
+
+async def get_metrics_summary(days: int = 30) -> Dict[str, Any]:
+    """Get every metric for a period, each from the result cache when possible"""
+    return {
+        "days": days,
+        "fronting_time": await get_fronting_time_metrics(days),
+        "switch_frequency": await get_switch_frequency_metrics(days),
+    }
@@ -0,0 +1,446 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure Python sweep gives the same results
+    np = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+US_PER_SECOND = 1_000_000
+
+# Fixed timeframes reported alongside every metrics request, as (name, seconds)
+TIMEFRAMES: Tuple[Tuple[str, int], ...] = (
+    ("24h", 24 * 3600),
+    ("48h", 48 * 3600),
+    ("5d", 5 * 24 * 3600),
+    ("7d", 7 * 24 * 3600),
+    ("30d", 30 * 24 * 3600),
+)
+
+
+def datetime_to_us(dt: datetime) -> int:
+    """Convert an aware datetime to epoch microseconds, exactly"""
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+class SwitchColumns:
+    """
+    Switch history stored column-wise, sorted oldest first.
+
+    `ts_us[i]` is the epoch microsecond timestamp of switch i, and the members
+    of switch i are `member_ids[j]` for j in `member_idx[offsets[i]:offsets[i + 1]]`.
+    Every member id is stored once, so sweeps work on small ints instead of
+    strings and dicts.
+    """
+
+    def __init__(self):
+        self.ts_us = array("q")
+        self.offsets = array("q", [0])
+        self.member_idx = array("q")
+        self.member_ids: List[str] = []
+        self.switch_ids: List[str] = []
+        self._index_of: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ts_us)
+
+    def append(self, ts_us: int, switch_id: str, members: List[str]):
+        """Add a switch, which must not be older than the last one"""
+        self.ts_us.append(ts_us)
+        self.switch_ids.append(switch_id)
+        for member_id in members:
+            idx = self._index_of.get(member_id)
+            if idx is None:
+                idx = self._index_of[member_id] = len(self.member_ids)
+                self.member_ids.append(member_id)
+            self.member_idx.append(idx)
+        self.offsets.append(len(self.member_idx))
+
+    def members_of(self, i: int) -> List[str]:
+        member_ids = self.member_ids
+        return [member_ids[idx] for idx in self.member_idx[self.offsets[i]:self.offsets[i + 1]]]
+
+    def first_at_or_after(self, ts_us: int) -> int:
+        """Index of the first switch at or after ts_us"""
+        return bisect_left(self.ts_us, ts_us)
+
+
+class SwitchHistory:
+    """
+    The switch store's history as columns, loaded once per store version.
+
+    Every metric reads the same columns, so timestamps and members are only
+    converted once. Switches appended to the store are appended to the columns;
+    any other change (see SwitchStore.rewrite_version) reloads them and bumps
+    `generation` so consumers holding state derived from them start over.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.columns = SwitchColumns()
+        self.generation = 0
+        self.version: Optional[int] = None
+        self.rewrite_version: Optional[int] = None
+
+    def refresh(self) -> SwitchColumns:
+        """Bring the columns up to date with the store and return them"""
+        version = self.store.version
+        if version == self.version:
+            return self.columns
+        rewrite_version = self.store.rewrite_version
+        columns = self.columns
+        if rewrite_version != self.rewrite_version:
+            columns = SwitchColumns()
+            switches = self.store.iter_switches()
+        elif len(columns):
+            switches = self.store.iter_switches(start_us=columns.ts_us[-1], after_id=columns.switch_ids[-1])
+        else:
+            switches = self.store.iter_switches()
+        for switch in switches:
+            columns.append(switch["ts_us"], switch["id"], switch["members"])
+
+        if columns is not self.columns:
+            self.columns = columns
+            self.generation += 1
+        self.version = version
+        self.rewrite_version = rewrite_version
+        return columns
+
+
+_switch_history: Optional[SwitchHistory] = None
+
+
+def get_switch_history() -> SwitchHistory:
+    """Get the columns for the shared switch store, created on first use"""
+    global _switch_history
+    if _switch_history is None:
+        from switch_store import switch_store
+        _switch_history = SwitchHistory(switch_store)
+    return _switch_history
+
+
+class FrontingTotals:
+    """Per-member fronting time in microseconds, for the whole period and each window"""
+
+    def __init__(self, total_us: int, member_ids: List[str], period_us: List[int], windows: Dict[str, List[int]]):
+        self.total_us = total_us
+        # Members in the order they first fronted during the period
+        self.member_ids = member_ids
+        self.period_us = period_us
+        self.windows = windows
+
+
+def _first_appearance_numpy(entries, member_count: int):
+    """Members ordered by their first entry, and each entry's position in that order"""
+    # (assigning in reverse leaves each member's earliest position)
+    first = np.full(member_count, len(entries), dtype=np.int64)
+    first[entries[::-1]] = np.arange(len(entries) - 1, -1, -1)
+    present = np.nonzero(first < len(entries))[0]
+    seen = present[np.argsort(first[present], kind="stable")]
+    slot = np.zeros(member_count, dtype=np.int64)
+    slot[seen] = np.arange(len(seen))
+    return seen, slot[entries]
+
+
+# ============================================================================
+# INTERVALS
+# ============================================================================
+
+def interval_range(columns: SwitchColumns, start_us: int, end_us: int) -> Tuple[int, int]:
+    """Indexes [lo, hi) of the switches whose fronting interval can overlap [start_us, end_us)"""
+    # The switch before start_us is still fronting when the range starts
+    lo = max(columns.first_at_or_after(start_us) - 1, 0)
+    hi = columns.first_at_or_after(end_us)
+    return lo, hi
+
+
+def interval_bounds(columns: SwitchColumns, i: int, start_us: int, end_us: int, now_us: int) -> Tuple[int, int]:
+    """Fronting interval of switch i (until the next switch, or now) clipped to [start_us, end_us)"""
+    ts_us = columns.ts_us
+    next_us = ts_us[i + 1] if i + 1 < len(ts_us) else now_us
+    return max(ts_us[i], start_us), min(next_us, end_us)
+
+
+# ============================================================================
+# WEEKLY HEATMAP
+# ============================================================================
+
+HOUR_US = 3600 * US_PER_SECOND
+WEEK_HOURS = 7 * 24
+# 1970-01-01 was a Thursday, 72 hours into its Monday-based week
+EPOCH_WEEK_HOUR = 3 * 24
+
+
+def compute_heatmap(columns: SwitchColumns, start_us: int, end_us: int, now_us: int,
+                    offset_us: int = 0) -> Tuple[List[str], List[List[int]]]:
+    """
+    Microseconds fronted by each member in each of the 168 hours of the week.
+
+    Bucket 0 is Monday 00:00-01:00, in UTC shifted by offset_us. Intervals are
+    clipped to [start_us, end_us). Instead of walking intervals hour by hour,
+    each interval adds its partial first and last hours directly, whole weeks
+    to every bucket at once, and the remaining whole hours as a range update
+    on a cyclic difference array; one prefix sum per member at the end turns
+    the ranges into bucket totals. Returns member ids in order of first
+    appearance and their 168 bucket values.
+    """
+    if np is not None:
+        return _heatmap_numpy(columns, start_us, end_us, now_us, offset_us)
+    return _heatmap_python(columns, start_us, end_us, now_us, offset_us)
+
+
+def _heatmap_python(columns: SwitchColumns, start_us: int, end_us: int, now_us: int,
+                    offset_us: int) -> Tuple[List[str], List[List[int]]]:
+    shift = offset_us + EPOCH_WEEK_HOUR * HOUR_US
+    offsets, member_idx = columns.offsets, columns.member_idx
+    # Per member: direct bucket amounts, range difference array and whole-week amount
+    direct: Dict[int, List[int]] = {}
+    diff: Dict[int, List[int]] = {}
+    weekly: Dict[int, int] = {}
+
+    lo, hi = interval_range(columns, start_us, end_us)
+    for i in range(lo, hi):
+        a, b = interval_bounds(columns, i, start_us, end_us, now_us)
+        if b <= a:
+            continue
+        a += shift
+        b += shift
+        first_hour, last_hour = a // HOUR_US, b // HOUR_US
+        whole_hours = max(last_hour - first_hour - 1, 0)
+        range_start = (first_hour + 1) % WEEK_HOURS
+        range_len = whole_hours % WEEK_HOURS
+
+        for j in range(offsets[i], offsets[i + 1]):
+            idx = member_idx[j]
+            if idx not in direct:
+                direct[idx] = [0] * WEEK_HOURS
+                diff[idx] = [0] * (WEEK_HOURS + 1)
+                weekly[idx] = 0
+            buckets = direct[idx]
+            if first_hour == last_hour:
+                buckets[first_hour % WEEK_HOURS] += b - a
+                continue
+            buckets[first_hour % WEEK_HOURS] += (first_hour + 1) * HOUR_US - a
+            buckets[last_hour % WEEK_HOURS] += b - last_hour * HOUR_US
+            weekly[idx] += (whole_hours // WEEK_HOURS) * HOUR_US
+            if range_len:
+                ranges = diff[idx]
+                ranges[range_start] += HOUR_US
+                range_end = range_start + range_len
+                if range_end <= WEEK_HOURS:
+                    ranges[range_end] -= HOUR_US
+                else:
+                    # Wraps past Sunday 23:00 back to Monday
+                    ranges[0] += HOUR_US
+                    ranges[range_end - WEEK_HOURS] -= HOUR_US
+
+    member_ids = []
+    matrix = []
+    for idx, buckets in direct.items():
+        running = 0
+        ranges = diff[idx]
+        for k in range(WEEK_HOURS):
+            running += ranges[k]
+            buckets[k] += running + weekly[idx]
+        member_ids.append(columns.member_ids[idx])
+        matrix.append(buckets)
+    return member_ids, matrix
+
+
+def _heatmap_numpy(columns: SwitchColumns, start_us: int, end_us: int, now_us: int,
+                   offset_us: int) -> Tuple[List[str], List[List[int]]]:
+    """Vectorized version of _heatmap_python"""
+    lo, hi = interval_range(columns, start_us, end_us)
+    if hi <= lo:
+        return [], []
+    ts = np.frombuffer(columns.ts_us, dtype=np.int64)
+    offsets = np.frombuffer(columns.offsets, dtype=np.int64)[lo:hi + 1]
+    entries = np.frombuffer(columns.member_idx, dtype=np.int64)[offsets[0]:offsets[-1]]
+
+    next_ts = np.append(ts[lo + 1:hi + 1], now_us) if hi == len(ts) else ts[lo + 1:hi + 1]
+    a = np.maximum(ts[lo:hi], start_us)
+    b = np.minimum(next_ts, end_us)
+    counts = np.where(b > a, np.diff(offsets), 0)
+    keep = np.repeat(counts > 0, np.diff(offsets))
+    entries = entries[keep]
+    if not len(entries):
+        return [], []
+    a = np.repeat(a, counts) + offset_us + EPOCH_WEEK_HOUR * HOUR_US
+    b = np.repeat(b, counts) + offset_us + EPOCH_WEEK_HOUR * HOUR_US
+
+    seen, slots = _first_appearance_numpy(entries, len(columns.member_ids))
+    members = len(seen)
+    first_hour, last_hour = a // HOUR_US, b // HOUR_US
+    same = first_hour == last_hour
+    whole_hours = np.maximum(last_hour - first_hour - 1, 0)
+    range_start = (first_hour + 1) % WEEK_HOURS
+    range_len = np.where(same, 0, whole_hours % WEEK_HOURS)
+    range_end = range_start + range_len
+    wraps = range_end > WEEK_HOURS
+
+    # Direct amounts for the partial first and last hours (one amount if they're the same hour)
+    base = slots * WEEK_HOURS
+    index = np.concatenate([base + first_hour % WEEK_HOURS, base + last_hour % WEEK_HOURS])
+    amounts = np.concatenate([
+        np.where(same, b - a, (first_hour + 1) * HOUR_US - a),
+        np.where(same, 0, b - last_hour * HOUR_US),
+    ])
+    # bincount sums in float64, which is exact for integers below 2**53 us (about 285 years)
+    direct = np.bincount(index, weights=amounts, minlength=members * WEEK_HOURS).reshape(members, WEEK_HOURS)
+
+    # Whole hours as range updates on a cyclic difference array (with one spare slot per member)
+    width = WEEK_HOURS + 1
+    has_range = range_len > 0
+    diff_base = slots * width
+    diff_index = np.concatenate([
+        diff_base + range_start,
+        diff_base + np.where(wraps, range_end - WEEK_HOURS, range_end),
+        (diff_base + 0)[wraps],
+    ])
+    diff_amounts = np.concatenate([
+        np.where(has_range, HOUR_US, 0),
+        np.where(has_range, -HOUR_US, 0),
+        np.full(int(wraps.sum()), HOUR_US),
+    ])
+    diff = np.bincount(diff_index, weights=diff_amounts, minlength=members * width).reshape(members, width)
+    ranges = np.cumsum(diff[:, :WEEK_HOURS], axis=1)
+
+    weekly = np.bincount(slots, weights=np.where(same, 0, whole_hours // WEEK_HOURS) * HOUR_US, minlength=members)
+
+    matrix = np.rint(direct + ranges + weekly[:, None]).astype(np.int64)
+    return [columns.member_ids[idx] for idx in seen.tolist()], matrix.tolist()
+
+
+# ============================================================================
+# CO-FRONTING
+# ============================================================================
+
+class CoFronting:
+    """
+    Time shared by members over a range, kept sparse.
+
+    `sets` maps each distinct fronting set (sorted member indexes) to
+    [microseconds, switches]; `pairs` maps each pair of member indexes that
+    actually fronted together to microseconds. Both only hold combinations
+    that occurred, so memory follows the history rather than members squared.
+    """
+
+    def __init__(self, sets: Dict[Tuple[int, ...], List[int]], pairs: Dict[Tuple[int, int], int], total_us: int):
+        self.sets = sets
+        self.pairs = pairs
+        self.total_us = total_us
+
+
+def compute_cofronting(columns: SwitchColumns, start_us: int, end_us: int, now_us: int) -> CoFronting:
+    """
+    Shared fronting time for every fronting set and member pair, clipped to [start_us, end_us).
+
+    Intervals are first summed per distinct fronting set, which there are far
+    fewer of than switches; pair totals are then derived from the sets, so
+    each pair combination is expanded once per set instead of once per switch.
+    """
+    offsets, member_idx = columns.offsets, columns.member_idx
+    sets: Dict[Tuple[int, ...], List[int]] = {}
+    total_us = 0
+    lo, hi = interval_range(columns, start_us, end_us)
+    for i in range(lo, hi):
+        a, b = interval_bounds(columns, i, start_us, end_us, now_us)
+        if b <= a:
+            continue
+        total_us += b - a
+        key = tuple(sorted(set(member_idx[offsets[i]:offsets[i + 1]])))
+        if not key:
+            continue
+        totals = sets.get(key)
+        if totals is None:
+            sets[key] = [b - a, 1]
+        else:
+            totals[0] += b - a
+            totals[1] += 1
+
+    pairs: Dict[Tuple[int, int], int] = {}
+    for key, (us, _) in sets.items():
+        for x in range(len(key)):
+            for y in range(x + 1, len(key)):
+                pair = (key[x], key[y])
+                pairs[pair] = pairs.get(pair, 0) + us
+    return CoFronting(sets, pairs, total_us)
+
+
+# ============================================================================
+# TIME SERIES
+# ============================================================================
+
+DAY_US = 24 * HOUR_US
+BUCKET_SIZES = {"hour": HOUR_US, "day": DAY_US, "week": WEEK_HOURS * HOUR_US}
+
+
+def _first_edge(start_us: int, bucket: str) -> int:
+    size = BUCKET_SIZES[bucket]
+    # Weeks are aligned to Monday rather than to the epoch's Thursday
+    align = EPOCH_WEEK_HOUR * HOUR_US if bucket == "week" else 0
+    return (start_us + align) // size * size - align
+
+
+def bucket_count(start_us: int, end_us: int, bucket: str) -> int:
+    """How many buckets bucket_edges() would return for the range, without building them"""
+    return max(-(-(end_us - _first_edge(start_us, bucket)) // BUCKET_SIZES[bucket]), 1)
+
+
+def bucket_edges(start_us: int, end_us: int, bucket: str) -> List[int]:
+    """
+    Bucket boundaries covering [start_us, end_us), aligned to UTC hours, days or
+    weeks (starting Monday). The first edge is at or before start_us and the last
+    at or after end_us. Check bucket_count() first for ranges from user input.
+    """
+    size = BUCKET_SIZES[bucket]
+    first = _first_edge(start_us, bucket)
+    return [first + k * size for k in range(bucket_count(start_us, end_us, bucket) + 1)]
+
+
+def compute_time_series(columns: SwitchColumns, start_us: int, end_us: int, now_us: int,
+                        edges: List[int]) -> Tuple[List[str], List[List[int]], List[int]]:
+    """
+    Microseconds fronted per member and switch counts for each bucket between edges.
+
+    Only the switches overlapping [start_us, end_us) are visited, found by
+    bisection. Intervals are clipped to the range and split at bucket edges;
+    intervals don't overlap, so the splitting is linear in switches plus
+    buckets. Switch counts are the differences between bisected positions of
+    the edges. Returns member ids in order of first appearance, their
+    per-bucket values and the per-bucket switch counts.
+    """
+    buckets = len(edges) - 1
+    offsets, member_idx = columns.offsets, columns.member_idx
+    rows: Dict[int, List[int]] = {}
+
+    lo, hi = interval_range(columns, start_us, end_us)
+    for i in range(lo, hi):
+        a, b = interval_bounds(columns, i, start_us, end_us, now_us)
+        if b <= a:
+            continue
+        # Split the interval at bucket edges once, then add the pieces for each member
+        pieces = []
+        k = bisect_right(edges, a) - 1
+        while a < b and k < buckets:
+            piece_end = min(b, edges[k + 1])
+            pieces.append((k, piece_end - a))
+            a = piece_end
+            k += 1
+        for j in range(offsets[i], offsets[i + 1]):
+            row = rows.get(member_idx[j])
+            if row is None:
+                row = rows[member_idx[j]] = [0] * buckets
+            for k, us in pieces:
+                row[k] += us
+
+    counts = []
+    for k in range(buckets):
+        first = columns.first_at_or_after(max(edges[k], start_us))
+        last = columns.first_at_or_after(min(edges[k + 1], end_us))
+        counts.append(max(last - first, 0))
+
+    return [columns.member_ids[idx] for idx in rows], list(rows.values()), counts
@@ -0,0 +1,207 @@
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from metrics_engine import TIMEFRAMES, US_PER_SECOND, FrontingTotals, SwitchColumns, SwitchHistory, get_switch_history
+
+# Windows other than the fixed timeframes (e.g. for unusual `days` values) are kept LRU
+MAX_EXTRA_WINDOWS = 8
+
+# Members of a switch are ordered by (switch start, switch id, position in the switch)
+OrderKey = Tuple[int, str, int]
+
+
+class RollingWindow:
+    """
+    Per-member fronting time over the last `seconds`, for closed intervals only.
+
+    Intervals are queued oldest first as they close and expired from the front
+    once they start before the window edge, so keeping the sums up to date
+    costs O(members of the interval) per switch. Each member also keeps a queue
+    of the order keys of its intervals, so the oldest one still in the window
+    gives its first appearance.
+    """
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.span_us = seconds * US_PER_SECOND
+        self.intervals: Deque[Tuple[int, str, List[str], int]] = deque()
+        self.sums: Dict[str, int] = {}
+        self.keys: Dict[str, Deque[OrderKey]] = {}
+
+    def push(self, start_us: int, switch_id: str, members: List[str], duration_us: int):
+        self.intervals.append((start_us, switch_id, members, duration_us))
+        for position, member_id in enumerate(members):
+            self.sums[member_id] = self.sums.get(member_id, 0) + duration_us
+            self.keys.setdefault(member_id, deque()).append((start_us, switch_id, position))
+
+    def expire(self, now_us: int):
+        edge = now_us - self.span_us
+        intervals = self.intervals
+        while intervals and intervals[0][0] < edge:
+            _, _, members, duration_us = intervals.popleft()
+            for member_id in members:
+                keys = self.keys[member_id]
+                keys.popleft()
+                if keys:
+                    self.sums[member_id] -= duration_us
+                else:
+                    del self.keys[member_id]
+                    del self.sums[member_id]
+
+
+class RollingFronting:
+    """
+    Fronting totals kept up to date as switches are added to the switch history.
+
+    New switches close the previous open interval, which is pushed to every
+    window; a read expires window edges and adds the still-open interval, so
+    it is O(members) instead of a pass over the history. Anything other than
+    appending newer switches (backfill, edits, deletes) rebuilds from the
+    history's columns.
+    """
+
+    def __init__(self, history: SwitchHistory):
+        self.history = history
+        self.windows: Dict[int, RollingWindow] = {seconds: RollingWindow(seconds) for _, seconds in TIMEFRAMES}
+        self.extra_windows: "OrderedDict[int, RollingWindow]" = OrderedDict()
+        self.current: Optional[Tuple[int, str, List[str]]] = None
+        # How many switches of the history have been applied, and from which generation
+        self.applied = 0
+        self.generation: Optional[int] = None
+        # The windows have been expired up to here, which can't be undone
+        self.now_us: Optional[int] = None
+
+    # ------------------------------------------------------------------------
+    # Keeping up with the switch history
+    # ------------------------------------------------------------------------
+
+    def refresh(self, now_us: int):
+        """Apply switches added to the history since the last read"""
+        columns = self.history.refresh()
+        if self.history.generation != self.generation:
+            self._rebuild(columns, now_us)
+            self.generation = self.history.generation
+            return
+        for i in range(self.applied, len(columns)):
+            self._append(columns, i)
+
+    def _append(self, columns: SwitchColumns, i: int):
+        start_us = columns.ts_us[i]
+        if self.current is not None:
+            prev_start, prev_id, prev_members = self.current
+            for window in self._all_windows():
+                window.push(prev_start, prev_id, prev_members, start_us - prev_start)
+        self.current = (start_us, columns.switch_ids[i], columns.members_of(i))
+        self.applied = i + 1
+
+    def _rebuild(self, columns: SwitchColumns, now_us: int):
+        self.windows = {seconds: RollingWindow(seconds) for seconds in self.windows}
+        self.extra_windows = OrderedDict((seconds, RollingWindow(seconds)) for seconds in self.extra_windows)
+        self.current = None
+        self.applied = 0
+        self.now_us = None
+        if not len(columns):
+            return
+
+        # Start from the oldest window edge, or the newest switch if it is older so it stays open
+        start = columns.first_at_or_after(now_us - max(self._all_spans()) * US_PER_SECOND)
+        for i in range(min(start, len(columns) - 1), len(columns)):
+            self._append(columns, i)
+
+    def _build_window(self, seconds: int, now_us: int) -> RollingWindow:
+        """Fill a new window from the history, up to the switch that is currently open"""
+        window = RollingWindow(seconds)
+        columns = self.history.columns
+        ts_us = columns.ts_us
+        for i in range(columns.first_at_or_after(now_us - window.span_us), self.applied - 1):
+            window.push(ts_us[i], columns.switch_ids[i], columns.members_of(i), ts_us[i + 1] - ts_us[i])
+        return window
+
+    def _all_spans(self) -> List[int]:
+        return list(self.windows) + list(self.extra_windows)
+
+    def _all_windows(self) -> List[RollingWindow]:
+        return list(self.windows.values()) + list(self.extra_windows.values())
+
+    def _window(self, seconds: int, now_us: int) -> RollingWindow:
+        window = self.windows.get(seconds)
+        if window is not None:
+            return window
+        window = self.extra_windows.get(seconds)
+        if window is not None:
+            self.extra_windows.move_to_end(seconds)
+            return window
+        window = self.extra_windows[seconds] = self._build_window(seconds, now_us)
+        if len(self.extra_windows) > MAX_EXTRA_WINDOWS:
+            self.extra_windows.popitem(last=False)
+        return window
+
+    # ------------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------------
+
+    def totals(self, now_us: int, period_seconds: int) -> Optional[FrontingTotals]:
+        """
+        Fronting totals for the period and every timeframe.
+
+        Returns None if no switch started within the period.
+        """
+        self.refresh(now_us)
+        if self.now_us is not None and now_us < self.now_us:
+            # An earlier read already expired intervals this one still counts
+            self._rebuild(self.history.columns, now_us)
+        self.now_us = now_us
+
+        period = self._window(period_seconds, now_us)
+        # Timeframes only count time within the period
+        timeframes = {
+            name: self._window(min(seconds, period_seconds), now_us) for name, seconds in TIMEFRAMES
+        }
+        for window in [period, *timeframes.values()]:
+            window.expire(now_us)
+
+        open_members: Counter = Counter()
+        open_us = 0
+        if self.current is not None:
+            open_members = Counter(self.current[2])
+            open_us = now_us - self.current[0]
+
+        def open_in(window: RollingWindow) -> bool:
+            return self.current is not None and self.current[0] >= now_us - window.span_us
+
+        if period.intervals:
+            first_start = period.intervals[0][0]
+        elif open_in(period):
+            first_start = self.current[0]
+        else:
+            return None
+
+        # Members ordered by their first interval in the period
+        order: Dict[str, OrderKey] = {member_id: keys[0] for member_id, keys in period.keys.items()}
+        if open_in(period):
+            start_us, switch_id, members = self.current
+            for position, member_id in enumerate(members):
+                order.setdefault(member_id, (start_us, switch_id, position))
+        member_ids = sorted(order, key=order.__getitem__)
+
+        def sums_for(window: RollingWindow) -> List[int]:
+            extra = open_us if open_in(window) else 0
+            return [window.sums.get(member_id, 0) + extra * open_members[member_id] for member_id in member_ids]
+
+        return FrontingTotals(
+            now_us - first_start,
+            member_ids,
+            sums_for(period),
+            {name: sums_for(window) for name, window in timeframes.items()},
+        )
+
+
+_rolling_fronting: Optional[RollingFronting] = None
+
+
+def get_rolling_fronting() -> RollingFronting:
+    """Get the rolling aggregates for the shared switch history, created on first use"""
+    global _rolling_fronting
+    if _rolling_fronting is None:
+        _rolling_fronting = RollingFronting(get_switch_history())
+    return _rolling_fronting
@@ -0,0 +1,138 @@
+import atexit
+import os
+import stat
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+from typing import Optional, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How hard a write tries to survive crashes:
+#   full   - fsync the file before it is renamed into place, and the directory after
+#   normal - fsync the file before it is renamed into place (default); a crash never
+#            leaves a truncated file, only a power loss right after the rename can
+#            bring back the previous version
+#   none   - no fsync; still atomic if the process dies, not if the machine does
+PERSIST_DURABILITY = os.getenv("PERSIST_DURABILITY", "normal").lower()
+
+# Seconds a change may wait so a burst of changes is written once (0 writes right away)
+PERSIST_FLUSH_DELAY = float(os.getenv("PERSIST_FLUSH_DELAY", 0.25))
+
+# SQLite's equivalent of each durability level
+SQLITE_SYNCHRONOUS = {"full": "FULL", "normal": "NORMAL", "none": "OFF"}
+
+if PERSIST_DURABILITY not in SQLITE_SYNCHRONOUS:
+    print(f"Unknown PERSIST_DURABILITY '{PERSIST_DURABILITY}', using normal")
+    PERSIST_DURABILITY = "normal"
+
+
+def atomic_write(path: Union[str, Path], data: Union[str, bytes], durability: str = PERSIST_DURABILITY):
+    """
+    Replace a file's contents without ever leaving a partial file behind.
+
+    The data goes to a temporary file next to the target, which is renamed
+    over it; how much is fsynced depends on `durability`.
+    """
+    path = str(path)
+    directory = os.path.dirname(path) or "."
+    # A unique temporary file per write, so concurrent writers (other workers) never share one
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+            if durability != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp creates the file private to us, keep the permissions a plain open() would give
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if durability == "full":
+        # Make the rename itself durable
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+# Writers with changes that haven't been written yet, flushed at exit
+_writers: "weakref.WeakSet[DebouncedWriter]" = weakref.WeakSet()
+
+
+class DebouncedWriter:
+    """
+    Writes a file's latest contents at most once per `delay` seconds.
+
+    The first change starts a timer and later changes only replace the pending
+    contents, so a burst of changes costs one write, at most `delay` after the
+    first of them. Readers should check `pending()` before the file, so they
+    see changes that haven't been written yet. `generation` counts changes.
+    """
+
+    def __init__(self, path: Union[str, Path], delay: float = PERSIST_FLUSH_DELAY,
+                 durability: str = PERSIST_DURABILITY):
+        self.path = path
+        self.delay = delay
+        self.durability = durability
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._pending: Optional[str] = None
+        self._timer: Optional[threading.Timer] = None
+
+    def pending(self) -> Optional[str]:
+        """Contents waiting to be written, or None if the file is up to date"""
+        return self._pending
+
+    def write(self, data: str):
+        with self._lock:
+            self._pending = data
+            self.generation += 1
+            if self.delay <= 0:
+                self._flush_locked()
+                return
+            _writers.add(self)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write pending contents now"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending is None:
+            return
+        try:
+            atomic_write(self.path, self._pending, self.durability)
+        except OSError as e:
+            # Keep the changes pending, the next change or flush tries again
+            print(f"Error writing {self.path}: {e}")
+            return
+        self._pending = None
+
+
+def flush_pending_writes():
+    """Write every pending change now, e.g. on shutdown"""
+    for writer in list(_writers):
+        writer.flush()
+
+atexit.register(flush_pending_writes)
@@ -1,18 +1,46 @@
+import asyncio
+import contextvars
 import httpx
 import os
+import random
+import time
 from dotenv import load_dotenv
-from cache import get_from_cache, set_in_cache
+from cache import MISS, get_from_cache, get_cache_entry, set_in_cache, invalidate_tags
+from singleflight import SingleFlight
+from http_clients import get_client
+from member_registry import MemberRegistry, compute_members_version
 
 load_dotenv()
 
 BASE_URL = "https://api.pluralkit.me/v2"
 TOKEN = os.getenv("SYSTEM_TOKEN")
 CACHE_TTL = int(os.getenv("CACHE_TTL", 30))
+# After CACHE_TTL the last good value keeps being served while it is refreshed
+# in the background, for at most this many extra seconds
+CACHE_MAX_STALE = int(os.getenv("CACHE_MAX_STALE", 300))
 
 HEADERS = {
     "Authorization": TOKEN
 }
 
+# Local request budget, kept under PluralKit's per-token rate limit
+PK_RATE_LIMIT = float(os.getenv("PK_RATE_LIMIT", 2))  # requests per second
+PK_RATE_BURST = int(os.getenv("PK_RATE_BURST", 5))
+# Retries for 429 and 5xx responses, with jittered exponential backoff
+PK_MAX_RETRIES = int(os.getenv("PK_MAX_RETRIES", 3))
+PK_BACKOFF_BASE = float(os.getenv("PK_BACKOFF_BASE", 0.5))
+PK_BACKOFF_MAX = float(os.getenv("PK_BACKOFF_MAX", 10))
+
+# Request priorities, user-facing reads always go before background refreshes
+PRIORITY_FOREGROUND = 0
+PRIORITY_BACKGROUND = 1
+
+# Cache tags describing which upstream data each entry is derived from
+TAG_SYSTEM = "system"
+TAG_MEMBERS = "members"
+TAG_FRONTERS = "fronters"
+TAG_SWITCHES = "switches"
+
 # Special member display names
 SPECIAL_DISPLAY_NAMES = {
     "answer": "Answer Machine",
@@ -20,30 +48,266 @@ SPECIAL_DISPLAY_NAMES = {
     "sleeping": "I am sleeping"
 }
 
+# ============================================================================
+# RATE LIMITED CLIENT
+# ============================================================================
+
+class TokenBucket:
+    """
+    Token bucket that spaces out requests before PluralKit's limit is hit.
+
+    The bucket refills at `rate` tokens per second up to `capacity`, and is
+    corrected from PluralKit's X-RateLimit-* headers after every response.
+    Background requests only take a token when no foreground request is
+    waiting and at least one token is left over for the next foreground one.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = max(rate, 0.01)
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._foreground_waiting = 0
+        self.waits = 0
+        self.throttled = 0
+        self.upstream_limit = None
+        self.upstream_remaining = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _ready(self, priority: int) -> bool:
+        if time.monotonic() < self._blocked_until:
+            return False
+        if priority == PRIORITY_FOREGROUND:
+            return self.tokens >= 1
+        return self._foreground_waiting == 0 and self.tokens >= min(2, self.capacity)
+
+    async def acquire(self, priority: int = PRIORITY_FOREGROUND):
+        if priority == PRIORITY_FOREGROUND:
+            self._foreground_waiting += 1
+        try:
+            waited = False
+            while True:
+                self._refill()
+                if self._ready(priority):
+                    self.tokens -= 1
+                    return
+                waited = True
+                delay = max(self._blocked_until - time.monotonic(), (1 - self.tokens) / self.rate, 0.01)
+                await asyncio.sleep(min(delay, 1.0))
+        finally:
+            if waited:
+                self.waits += 1
+            if priority == PRIORITY_FOREGROUND:
+                self._foreground_waiting -= 1
+
+    def block_for(self, seconds: float):
+        """Stop handing out tokens for a while (e.g. after a 429)"""
+        self.throttled += 1
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """Sync the local budget with PluralKit's X-RateLimit-* response headers"""
+        try:
+            if "X-RateLimit-Limit" in headers:
+                self.upstream_limit = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Remaining" not in headers:
+                return
+            remaining = int(headers["X-RateLimit-Remaining"])
+        except ValueError:
+            return
+        self.upstream_remaining = remaining
+        self._refill()
+        self.tokens = min(self.tokens, float(remaining))
+        if remaining <= 0 and "X-RateLimit-Reset" in headers:
+            reset_in = _parse_reset(headers["X-RateLimit-Reset"])
+            if reset_in is not None:
+                self.block_for(reset_in)
+
+    def stats(self):
+        self._refill()
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "tokens": round(self.tokens, 2),
+            "blocked_for": max(self._blocked_until - time.monotonic(), 0),
+            "foreground_waiting": self._foreground_waiting,
+            "waits": self.waits,
+            "throttled": self.throttled,
+            "upstream_limit": self.upstream_limit,
+            "upstream_remaining": self.upstream_remaining,
+        }
+
+def _parse_reset(value: str):
+    """Seconds until a X-RateLimit-Reset value, which may be epoch ms, epoch seconds or relative seconds"""
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        reset = reset / 1000 - time.time()
+    elif reset > 1e9:
+        reset = reset - time.time()
+    return max(reset, 0)
+
+def _retry_after(resp: httpx.Response):
+    """How long PluralKit asked us to wait, from Retry-After or the 429 body (in ms)"""
+    if "Retry-After" in resp.headers:
+        try:
+            return float(resp.headers["Retry-After"])
+        except ValueError:
+            pass
+    try:
+        retry_after = resp.json().get("retry_after")
+        if retry_after is not None:
+            return float(retry_after) / 1000
+    except Exception:
+        pass
+    return None
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: a random delay between 0 and the exponential cap
+    return random.uniform(0, min(PK_BACKOFF_MAX, PK_BACKOFF_BASE * (2 ** attempt)))
+
+pk_bucket = TokenBucket(PK_RATE_LIMIT, PK_RATE_BURST)
+
+# Priority of requests made from the current task, set to background by refreshes
+_request_priority = contextvars.ContextVar("pk_request_priority", default=PRIORITY_FOREGROUND)
+
+def get_rate_limit_stats():
+    return pk_bucket.stats()
+
+async def pk_request(method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Make a request to the PluralKit API within the local rate limit budget.
+
+    429 responses are retried after the delay PluralKit asks for, and 5xx
+    responses and network errors of idempotent requests are retried with
+    jittered exponential backoff. The last response is returned as-is.
+    """
+    client = get_client("pluralkit")
+    priority = _request_priority.get()
+    idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+    
+    for attempt in range(PK_MAX_RETRIES + 1):
+        await pk_bucket.acquire(priority)
+        last_attempt = attempt == PK_MAX_RETRIES
+        try:
+            resp = await client.request(method, f"{BASE_URL}{path}", headers=HEADERS, **kwargs)
+        except httpx.TransportError as e:
+            if not idempotent or last_attempt:
+                raise
+            delay = _backoff(attempt)
+            print(f"PluralKit request {method} {path} failed ({e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        
+        pk_bucket.update_from_headers(resp.headers)
+        
+        if resp.status_code == 429 and not last_attempt:
+            delay = _retry_after(resp)
+            if delay is None:
+                delay = _backoff(attempt)
+            pk_bucket.block_for(delay)
+            print(f"PluralKit rate limited {method} {path}, retrying in {delay:.2f}s")
+            continue
+        
+        if resp.status_code >= 500 and idempotent and not last_attempt:
+            delay = _backoff(attempt)
+            print(f"PluralKit returned {resp.status_code} for {method} {path}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        
+        return resp
+    
+    return resp
+
+# ============================================================================
+# CACHED DATA
+# ============================================================================
+
+# Concurrent cache misses for the same key share one upstream request
+pk_flight = SingleFlight("pluralkit")
+
+# Keep references to background refreshes so they aren't garbage collected
+_background_refreshes = set()
+
+def get_singleflight_stats():
+    return pk_flight.stats()
+
+async def _get_cached(cache_key, fetch):
+    """
+    Serve a cached value, falling back to fetch() on a miss.
+
+    A stale value (past CACHE_TTL but within CACHE_MAX_STALE) is returned
+    immediately and refreshed in the background, so only cold misses wait
+    on PluralKit.
+    """
+    entry = get_cache_entry(cache_key)
+    if entry is not None:
+        value, is_stale = entry
+        if is_stale:
+            _refresh_in_background(cache_key, fetch)
+        return value
+    return await pk_flight.do(cache_key, fetch)
+
+def _refresh_in_background(cache_key, fetch):
+    if pk_flight.in_flight(cache_key):
+        return
+    
+    async def refresh():
+        # Refreshes queue behind user-facing requests in the rate limiter
+        _request_priority.set(PRIORITY_BACKGROUND)
+        try:
+            await pk_flight.do(cache_key, fetch)
+        except Exception as e:
+            print(f"Background refresh of '{cache_key}' failed: {e}")
+    
+    task = asyncio.create_task(refresh())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
 async def get_system():
-    cache_key = "system"
-    if (cached := get_from_cache(cache_key)):
-        return cached
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{BASE_URL}/systems/@me", headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        set_in_cache(cache_key, data, CACHE_TTL)
-        return data
+    return await _get_cached("system", _fetch_system)
+
+async def _fetch_system():
+    resp = await pk_request("GET", "/systems/@me")
+    resp.raise_for_status()
+    data = resp.json()
+    set_in_cache("system", data, stale_ttl=CACHE_MAX_STALE, tags=(TAG_SYSTEM,))
+    return data
+
+# Registry for the current member data, rebuilt only when its version changes
+_registry = None
+
+async def get_member_registry() -> MemberRegistry:
+    """Get the processed members indexed by id and name"""
+    return _registry_for(await _get_cached("members", _fetch_members))
+
+def _registry_for(cached) -> MemberRegistry:
+    global _registry
+    if isinstance(cached, list):
+        # Written by an older version (e.g. restored from a snapshot) without a version
+        cached = {"version": compute_members_version(cached), "members": cached}
+    if _registry is None or _registry.version != cached["version"]:
+        _registry = MemberRegistry(cached["members"], cached["version"])
+    return _registry
 
 async def get_members():
-    cache_key = "members"
-    if (cached := get_from_cache(cache_key)):
-        return cached
-    
+    return (await get_member_registry()).members
+
+async def _fetch_members():
     # Get all members from PluralKit
     base_cache_key = "members_raw"
-    if not (cached_raw := get_from_cache(base_cache_key)):
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"{BASE_URL}/systems/@me/members", headers=HEADERS)
-            resp.raise_for_status()
-            cached_raw = resp.json()
-            set_in_cache(base_cache_key, cached_raw, CACHE_TTL)
+    if (cached_raw := get_from_cache(base_cache_key, MISS)) is MISS:
+        resp = await pk_request("GET", "/systems/@me/members")
+        resp.raise_for_status()
+        cached_raw = resp.json()
+        set_in_cache(base_cache_key, cached_raw, tags=(TAG_MEMBERS,))
     
     data = cached_raw
     
@@ -67,43 +331,54 @@ async def get_members():
         else:
             processed_members.append(member)
     
-    set_in_cache(cache_key, processed_members, CACHE_TTL)
-    return processed_members
+    # Cache the list with its version so every worker can tell whether its registry is current
+    cached = {"version": compute_members_version(data), "members": processed_members}
+    set_in_cache("members", cached, stale_ttl=CACHE_MAX_STALE, tags=(TAG_MEMBERS,))
+    _registry_for(cached)
+    return cached
 
 async def get_fronters():
-    cache_key = "fronters"
-    if (cached := get_from_cache(cache_key)):
-        return cached
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{BASE_URL}/systems/@me/fronters", headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
+    return await _get_cached("fronters", _fetch_fronters)
+
+async def _fetch_fronters():
+    resp = await pk_request("GET", "/systems/@me/fronters")
+    resp.raise_for_status()
+    data = resp.json()
+    
+    # Process special members in fronters
+    if "members" in data:
+        # Get all members for reference
+        registry = await get_member_registry()
         
-        # Process special members in fronters
-        if "members" in data:
-            # Get all members for reference
-            all_members = await get_members()
+        processed_fronters = []
+        for member in data["members"]:
+            # Find the processed member data from our get_members function
+            processed_member = registry.get(member.get("id"))
             
-            processed_fronters = []
-            for member in data["members"]:
-                # Find the processed member data from our get_members function
-                processed_member = None
-                for m in all_members:
-                    if m.get("id") == member.get("id"):
-                        processed_member = m
-                        break
-                
-                if processed_member:
-                    # Use the processed member data (which includes special display name handling)
-                    processed_fronters.append(processed_member)
-                else:
-                    # Fallback to original member data
-                    processed_fronters.append(member)
-            
-            data["members"] = processed_fronters
+            if processed_member:
+                # Use the processed member data (which includes special display name handling)
+                processed_fronters.append(processed_member)
+            else:
+                # Fallback to original member data
+                processed_fronters.append(member)
         
-        set_in_cache(cache_key, data, CACHE_TTL)
-        return data
+        data["members"] = processed_fronters
+    
+    # Fronters embed processed member data, so they depend on both
+    set_in_cache("fronters", data, stale_ttl=CACHE_MAX_STALE, tags=(TAG_FRONTERS, TAG_MEMBERS))
+    return data
+
+def invalidate_member_data():
+    """Drop cached member data and everything derived from it (including fronters)"""
+    return invalidate_tags(TAG_MEMBERS)
+
+def invalidate_fronter_data():
+    """Drop cached fronter data and the switch history it comes from"""
+    return invalidate_tags(TAG_FRONTERS, TAG_SWITCHES)
+
+def invalidate_system_data():
+    """Drop cached system data"""
+    return invalidate_tags(TAG_SYSTEM)
 
 async def set_front(member_ids):
     """
@@ -111,17 +386,19 @@ async def set_front(member_ids):
     Pass an empty list to clear the front.
     """
     # Clear fronters cache since we're updating it
-    cache_key = "fronters"
-    set_in_cache(cache_key, None, 0)  # Invalidate cache
+    invalidate_fronter_data()
     
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{BASE_URL}/systems/@me/switches",
-            headers=HEADERS,
-            json={"members": member_ids}
-        )
-        if resp.status_code not in (200, 204):
-            raise Exception(f"Failed to set front: {resp.status_code} - {resp.text}")
-
-        # If there's a response body, return it, otherwise return None
-        return resp.json() if resp.content else None
\ No newline at end of file
+    resp = await pk_request(
+        "POST",
+        "/systems/@me/switches",
+        json={"members": member_ids}
+    )
+    if resp.status_code not in (200, 204):
+        raise Exception(f"Failed to set front: {resp.status_code} - {resp.text}")
+
+    # Pick the new switch up in the local switch history
+    from switch_store import request_switch_sync
+    request_switch_sync()
+
+    # If there's a response body, return it, otherwise return None
+    return resp.json() if resp.content else None
\ No newline at end of file
@@ -0,0 +1,66 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight awaitable.
+
+    The first caller for a key starts the work, every caller that arrives while
+    it is still running awaits the same task and gets the same result (or the
+    same exception). The task is shielded, so a cancelled caller does not abort
+    the fetch for everybody else.
+
+    Per-key counts are kept for every key ever seen, so turn them off with
+    `per_key_stats=False` for flights whose keys keep changing.
+    """
+
+    def __init__(self, name: str = "default", per_key_stats: bool = True):
+        self.name = name
+        self.per_key_stats = per_key_stats
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._per_key: Dict[str, Dict[str, int]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        key_stats = {"calls": 0, "executions": 0, "coalesced": 0}
+        if self.per_key_stats:
+            key_stats = self._per_key.setdefault(key, key_stats)
+        key_stats["calls"] += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            key_stats["coalesced"] += 1
+        else:
+            self.executions += 1
+            key_stats["executions"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": list(self._inflight.keys()),
+            "keys": {key: dict(values) for key, values in self._per_key.items()},
+        }
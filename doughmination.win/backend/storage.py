@@ -0,0 +1,406 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from dotenv import load_dotenv
+from persistence import PERSIST_DURABILITY, SQLITE_SYNCHRONOUS, DebouncedWriter
+
+load_dotenv()
+
+# Define data directory
+DATA_DIR = Path("dough-data")
+STORAGE_DB_FILE = DATA_DIR / "storage.db"
+
+# Ensure data directory exists
+DATA_DIR.mkdir(exist_ok=True)
+
+# Where users, member tags, member statuses and the mental state are kept:
+#   sqlite - one SQLite database in WAL mode with a row per record (default);
+#            existing JSON files are imported into it once
+#   json   - the original JSON files, rewritten as a whole (see persistence.py)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+
+# Keyed collections, with the JSON file each one is kept in and, for files that
+# hold a list (users.json), the field the records are keyed by
+COLLECTIONS = {
+    "users": ("users.json", "id"),
+    "member_tags": ("member_tags.json", None),
+    "member_status": ("member_status.json", None),
+}
+
+# Single JSON values and the file each one is kept in
+DOCUMENTS = {
+    "mental_state": "mental_state.json",
+}
+
+
+# ============================================================================
+# JSON BACKEND
+# ============================================================================
+
+def _file_signature(path: Path) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class JSONFile:
+    """
+    A JSON file written atomically, with bursts of changes written once.
+
+    Reads see changes that are still waiting to be written. `version` changes
+    with every change made here and with the file itself, so changes made by
+    other workers are noticed too.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._writer = DebouncedWriter(path)
+
+    def version(self) -> Hashable:
+        return (_file_signature(self.path), self._writer.generation)
+
+    def exists(self) -> bool:
+        return self._writer.pending() is not None or os.path.exists(self.path)
+
+    def read(self) -> Optional[Any]:
+        """The file's contents, or None if it doesn't exist"""
+        pending = self._writer.pending()
+        if pending is not None:
+            return json.loads(pending)
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def write(self, data: Any):
+        # Serialized right away, so later changes to `data` don't leak into the file
+        self._writer.write(json.dumps(data, indent=2))
+
+
+class _Collection(ABC):
+    _snapshot: Optional[Tuple[Hashable, Dict[str, Any]]] = None
+
+    @abstractmethod
+    def version(self) -> Hashable:
+        ...
+
+    @abstractmethod
+    def get_all(self) -> Dict[str, Any]:
+        ...
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        All records, kept in memory until the version changes.
+
+        Shared by every caller, so it must not be modified; use get_all() for
+        a copy to change.
+        """
+        # Taken before reading, so a write that lands mid-read is picked up next time
+        version = self.version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != version:
+            snapshot = self._snapshot = (version, self.get_all())
+        return snapshot[1]
+
+
+class JSONCollection(_Collection):
+    """
+    A collection kept in one JSON file, read and rewritten as a whole.
+
+    `version` is the file's version (see JSONFile), so changes made by other
+    workers are noticed.
+    """
+
+    def __init__(self, path: Path, key_field: Optional[str] = None):
+        self.path = path
+        self.key_field = key_field
+        self.file = JSONFile(path)
+        self._lock = threading.Lock()
+
+    def version(self) -> Hashable:
+        return self.file.version()
+
+    def exists(self) -> bool:
+        return self.file.exists()
+
+    def get_all(self) -> Dict[str, Any]:
+        data = self.file.read()
+        if data is None:
+            return {}
+        if self.key_field:
+            return {record[self.key_field]: record for record in data}
+        return data
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_all().get(key)
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            records = self.get_all()
+            records[key] = value
+            self.replace_all(records)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            records = self.get_all()
+            if key not in records:
+                return False
+            del records[key]
+            self.replace_all(records)
+            return True
+
+    def replace_all(self, records: Dict[str, Any]):
+        self.file.write(list(records.values()) if self.key_field else dict(records))
+
+
+class JSONDocuments:
+    """Single values kept in one JSON file each"""
+
+    def __init__(self):
+        self.files = {name: JSONFile(DATA_DIR / filename) for name, filename in DOCUMENTS.items()}
+
+    def get(self, name: str) -> Optional[Any]:
+        return self.files[name].read()
+
+    def set(self, name: str, value: Any):
+        self.files[name].write(value)
+
+
+# ============================================================================
+# SQLITE BACKEND
+# ============================================================================
+
+class SQLiteStorage:
+    """
+    Collections and documents in one SQLite database in WAL mode (the "sqlite" backend).
+
+    Each collection is a table with a row per record, so a change writes one
+    row instead of the whole collection, and readers in every worker run
+    concurrently with a writer. The JSON files are imported once, the first
+    time the database is opened. `version` combines PRAGMA data_version, which
+    changes when another connection commits, with a count of this connection's
+    own writes, so in-memory copies know when to reload.
+    """
+
+    def __init__(self, path: Path = STORAGE_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(str(path), timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS[PERSIST_DURABILITY]}")
+        for name in COLLECTIONS:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS storage_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._migrate_json_files()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM storage_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute(
+            "INSERT INTO storage_meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def _write(self, collection: Optional[str], statements):
+        """Run (sql, params) statements in one transaction, marking the collection as created"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                if collection is not None:
+                    self._set_meta(f"created:{collection}", "1")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+
+    def _migrate_json_files(self):
+        """Import the JSON files of the json backend, once per collection or document"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name, (filename, key_field) in COLLECTIONS.items():
+                    if self._get_meta(f"migrated:{name}"):
+                        continue
+                    source = JSONCollection(DATA_DIR / filename, key_field)
+                    if source.exists():
+                        records = source.get_all()
+                        self._conn.executemany(
+                            f"INSERT OR REPLACE INTO {name} (key, value) VALUES (?, ?)",
+                            [(key, json.dumps(value)) for key, value in records.items()]
+                        )
+                        self._set_meta(f"created:{name}", "1")
+                        print(f"Imported {len(records)} records from {source.path} into {self.path}")
+                    self._set_meta(f"migrated:{name}", "1")
+
+                for name, filename in DOCUMENTS.items():
+                    if self._get_meta(f"migrated:{name}"):
+                        continue
+                    path = DATA_DIR / filename
+                    if os.path.exists(path):
+                        with open(path, "r") as f:
+                            value = json.load(f)
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO documents (name, value) VALUES (?, ?)",
+                            (name, json.dumps(value))
+                        )
+                        print(f"Imported {path} into {self.path}")
+                    self._set_meta(f"migrated:{name}", "1")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def version(self) -> Hashable:
+        with self._lock:
+            return (self._conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+
+    def exists(self, collection: str) -> bool:
+        with self._lock:
+            return self._get_meta(f"created:{collection}") is not None
+
+    def get_all(self, collection: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key, value FROM {collection} ORDER BY rowid").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def get(self, collection: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {collection} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, collection: str, key: str, value: Any):
+        # An upsert keeps the row's rowid, so records stay in insertion order
+        self._write(collection, [(
+            f"INSERT INTO {collection} (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value))
+        )])
+
+    def delete(self, collection: str, key: str) -> bool:
+        if self.get(collection, key) is None:
+            return False
+        self._write(collection, [(f"DELETE FROM {collection} WHERE key = ?", (key,))])
+        return True
+
+    def replace_all(self, collection: str, records: Dict[str, Any]):
+        self._write(collection, [(f"DELETE FROM {collection}", ())] + [
+            (f"INSERT INTO {collection} (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            for key, value in records.items()
+        ])
+
+    def get_document(self, name: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM documents WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_document(self, name: str, value: Any):
+        self._write(None, [(
+            "INSERT INTO documents (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, json.dumps(value))
+        )])
+
+
+class SQLiteCollection(_Collection):
+    """One collection of SQLiteStorage, with the same interface as JSONCollection"""
+
+    def __init__(self, storage: SQLiteStorage, name: str):
+        self.storage = storage
+        self.name = name
+
+    def version(self) -> Hashable:
+        return self.storage.version()
+
+    def exists(self) -> bool:
+        return self.storage.exists(self.name)
+
+    def get_all(self) -> Dict[str, Any]:
+        return self.storage.get_all(self.name)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.storage.get(self.name, key)
+
+    def put(self, key: str, value: Any):
+        self.storage.put(self.name, key, value)
+
+    def delete(self, key: str) -> bool:
+        return self.storage.delete(self.name, key)
+
+    def replace_all(self, records: Dict[str, Any]):
+        self.storage.replace_all(self.name, records)
+
+
+# ============================================================================
+# ACCESS
+# ============================================================================
+
+_storage: Optional[SQLiteStorage] = None
+_collections: Dict[str, Any] = {}
+_json_documents = JSONDocuments()
+
+def _use_sqlite() -> bool:
+    if STORAGE_BACKEND == "sqlite":
+        return True
+    if STORAGE_BACKEND != "json":
+        print(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', using sqlite")
+        return True
+    return False
+
+def get_storage() -> Optional[SQLiteStorage]:
+    """Get the SQLite storage, opened (and migrated) on first use, or None with the json backend"""
+    global _storage
+    if _storage is None and _use_sqlite():
+        _storage = SQLiteStorage()
+        print(f"Using sqlite storage backend at {_storage.path}")
+    return _storage
+
+def get_collection(name: str):
+    """Get a keyed collection ("users", "member_tags" or "member_status") of the configured backend"""
+    collection = _collections.get(name)
+    if collection is None:
+        storage = get_storage()
+        if storage is not None:
+            collection = SQLiteCollection(storage, name)
+        else:
+            filename, key_field = COLLECTIONS[name]
+            collection = JSONCollection(DATA_DIR / filename, key_field)
+        _collections[name] = collection
+    return collection
+
+def get_document(name: str) -> Optional[Any]:
+    """Get a single stored value ("mental_state"), or None if it was never set"""
+    storage = get_storage()
+    if storage is not None:
+        return storage.get_document(name)
+    return _json_documents.get(name)
+
+def set_document(name: str, value: Any):
+    storage = get_storage()
+    if storage is not None:
+        storage.set_document(name, value)
+    else:
+        _json_documents.set(name, value)
@@ -0,0 +1,480 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Define data directory
+DATA_DIR = Path("dough-data")
+SWITCHES_DB_FILE = DATA_DIR / "switches.db"
+
+# Ensure data directory exists
+DATA_DIR.mkdir(exist_ok=True)
+
+# How often the local store checks PluralKit for new switches
+SWITCH_SYNC_INTERVAL = int(os.getenv("SWITCH_SYNC_INTERVAL", os.getenv("CACHE_TTL", 30)))
+
+# Seconds a worker's claim on syncing lasts without being renewed; only the worker
+# holding it syncs with PluralKit, the others read what it stores
+SWITCH_SYNC_LEASE = int(os.getenv("SWITCH_SYNC_LEASE", max(3 * SWITCH_SYNC_INTERVAL, 60)))
+
+# PluralKit returns at most 100 switches per page
+PAGE_SIZE = 100
+
+
+def _timestamp_to_us(timestamp: str) -> int:
+    """Convert a PluralKit timestamp to epoch microseconds"""
+    from metrics import timestamp_to_us
+    return timestamp_to_us(timestamp)
+
+
+class SwitchStore:
+    """
+    Local copy of the system's full switch history.
+
+    The first sync backfills the whole history by paging backwards with
+    PluralKit's `before` parameter; after that only switches newer than the
+    newest stored one are fetched. Reads never touch PluralKit. `version`
+    changes whenever the stored history does; `rewrite_version` only changes
+    when it changes other than by appending switches newer than every stored
+    one, so incremental consumers know when they have to start over.
+
+    Every worker opens the same database; a lease in `switch_meta` makes sure
+    only one of them syncs with PluralKit at a time.
+    """
+
+    def __init__(self, path: Path = SWITCHES_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sync_lock = asyncio.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS switches (
+                id TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                ts_us INTEGER NOT NULL,
+                members TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS switches_ts_us ON switches (ts_us);
+            CREATE TABLE IF NOT EXISTS switch_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self.last_sync: Optional[float] = None
+        self._listeners: List[Callable[[], None]] = []
+        # Identifies this worker in the sync lease
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._seen_version: Optional[int] = None
+
+    # ------------------------------------------------------------------------
+    # Metadata
+    # ------------------------------------------------------------------------
+
+    def _get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM switch_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value: Any):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO switch_meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return int(self._get_meta("version", "0"))
+
+    @property
+    def rewrite_version(self) -> int:
+        with self._lock:
+            return int(self._get_meta("rewrite_version", "0"))
+
+    @property
+    def backfill_complete(self) -> bool:
+        with self._lock:
+            return self._get_meta("backfill_complete") == "1"
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Call callback (synchronously, so keep it cheap) after every change to the history or its backfill"""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in switch store listener: {e}")
+
+    def _bump_version(self, rewrite: bool = False):
+        self._set_meta("version", int(self._get_meta("version", "0")) + 1)
+        if rewrite:
+            self._set_meta("rewrite_version", int(self._get_meta("rewrite_version", "0")) + 1)
+
+    # ------------------------------------------------------------------------
+    # Sync lease
+    # ------------------------------------------------------------------------
+
+    def acquire_sync_lease(self, duration: float = SWITCH_SYNC_LEASE) -> bool:
+        """Take or renew the right to sync for `duration` seconds, unless another worker holds it"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                owner = self._get_meta("sync_owner")
+                until = float(self._get_meta("sync_lease_until", "0"))
+                acquired = owner == self.worker_id or until <= now
+                if acquired:
+                    self._set_meta("sync_owner", self.worker_id)
+                    self._set_meta("sync_lease_until", now + duration)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def release_sync_lease(self):
+        """Give up the lease (e.g. on shutdown) so another worker takes over right away"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE switch_meta SET value = '0' WHERE key = 'sync_lease_until' "
+                "AND EXISTS (SELECT 1 FROM switch_meta WHERE key = 'sync_owner' AND value = ?)",
+                (self.worker_id,)
+            )
+
+    def holds_sync_lease(self) -> bool:
+        with self._lock:
+            return (self._get_meta("sync_owner") == self.worker_id
+                    and float(self._get_meta("sync_lease_until", "0")) > time.time())
+
+    def check_for_changes(self):
+        """Notify listeners if another worker changed the history since the last check"""
+        version = self.version
+        if self._seen_version is not None and version != self._seen_version:
+            self._notify()
+        self._seen_version = version
+
+    # ------------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM switches").fetchone()[0]
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, timestamp, members, ts_us FROM switches ORDER BY ts_us DESC, id DESC LIMIT 1"
+            ).fetchone()
+        return _row_to_switch(row) if row else None
+
+    def switch_before(self, ts_us: int) -> Optional[Dict[str, Any]]:
+        """Get the newest switch before ts_us, i.e. the one in effect just before it"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, timestamp, members, ts_us FROM switches WHERE ts_us < ? ORDER BY ts_us DESC, id DESC LIMIT 1",
+                (ts_us,)
+            ).fetchone()
+        return _row_to_switch(row) if row else None
+
+    def iter_switches(self, start_us: Optional[int] = None, end_us: Optional[int] = None,
+                      chunk_size: int = 1000, after_id: str = "") -> Iterator[Dict[str, Any]]:
+        """
+        Iterate switches oldest first in chunks, without loading the whole history.
+
+        With after_id, switches at start_us are only included if their id sorts
+        after it, so (start_us, after_id) of the last switch seen resumes after it.
+        """
+        last_ts = start_us if start_us is not None else -(2 ** 63)
+        last_id = after_id
+        while True:
+            query = ("SELECT id, timestamp, members, ts_us FROM switches "
+                     "WHERE (ts_us > ? OR (ts_us = ? AND id > ?))")
+            params: List[Any] = [last_ts, last_ts, last_id]
+            if end_us is not None:
+                query += " AND ts_us < ?"
+                params.append(end_us)
+            query += " ORDER BY ts_us, id LIMIT ?"
+            params.append(chunk_size)
+            with self._lock:
+                rows = self._conn.execute(query, params).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_switch(row)
+            last_ts, last_id = rows[-1][3], rows[-1][0]
+
+    # ------------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------------
+
+    def add_switches(self, switches: List[Dict[str, Any]]) -> int:
+        """Insert switches that aren't stored yet, returning how many were added"""
+        rows = []
+        for switch in switches:
+            try:
+                rows.append((
+                    switch["id"],
+                    switch["timestamp"],
+                    _timestamp_to_us(switch["timestamp"]),
+                    json.dumps(switch.get("members", [])),
+                ))
+            except Exception as e:
+                print(f"Skipping malformed switch {switch.get('id', 'unknown')}: {e}")
+        if not rows:
+            return 0
+        insert = "INSERT OR IGNORE INTO switches (id, timestamp, ts_us, members) VALUES (?, ?, ?, ?)"
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Switches that sort before the newest stored one (e.g. from the backfill) rewrite history
+                newest = self._conn.execute(
+                    "SELECT ts_us, id FROM switches ORDER BY ts_us DESC, id DESC LIMIT 1"
+                ).fetchone()
+                older = [row for row in rows if newest and (row[2], row[0]) <= tuple(newest)]
+                newer = [row for row in rows if not newest or (row[2], row[0]) > tuple(newest)]
+                self._conn.executemany(insert, older)
+                rewrite = self._conn.total_changes > before
+                self._conn.executemany(insert, newer)
+                added = self._conn.total_changes - before
+                if added:
+                    self._bump_version(rewrite=rewrite)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if added:
+            self._notify()
+        return added
+
+    def update_switch(self, switch_id: str, data: Dict[str, Any]) -> bool:
+        """Apply changed fields (timestamp and/or members) to a stored switch"""
+        updates = []
+        params: List[Any] = []
+        if data.get("timestamp"):
+            updates += ["timestamp = ?", "ts_us = ?"]
+            params += [data["timestamp"], _timestamp_to_us(data["timestamp"])]
+        if "members" in data:
+            updates.append("members = ?")
+            params.append(json.dumps(data["members"] or []))
+        if not updates:
+            return False
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE switches SET {', '.join(updates)} WHERE id = ?", params + [switch_id]
+            )
+            changed = cursor.rowcount > 0
+            if changed:
+                self._bump_version(rewrite=True)
+        if changed:
+            self._notify()
+        return changed
+
+    def delete_switch(self, switch_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM switches WHERE id = ?", (switch_id,))
+            changed = cursor.rowcount > 0
+            if changed:
+                self._bump_version(rewrite=True)
+        if changed:
+            self._notify()
+        return changed
+
+    def clear(self):
+        """Drop the whole history (e.g. after every switch was deleted upstream)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM switches")
+            self._set_meta("backfill_complete", "1")
+            self._bump_version(rewrite=True)
+        self._notify()
+
+    # ------------------------------------------------------------------------
+    # Syncing with PluralKit
+    # ------------------------------------------------------------------------
+
+    async def _fetch_page(self, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        from pluralkit import pk_request
+        params: Dict[str, Any] = {"limit": PAGE_SIZE}
+        if before:
+            params["before"] = before
+        resp = await pk_request("GET", "/systems/@me/switches", params=params)
+        resp.raise_for_status()
+        return resp.json() if resp.content else []
+
+    async def sync(self, backfill: bool = True) -> int:
+        """Fetch new switches and continue the backfill if it isn't done, returning how many were added"""
+        async with self._sync_lock:
+            added = await self._sync_new()
+            if backfill and not self.backfill_complete:
+                added += await self._backfill()
+            self.last_sync = time.time()
+            self._seen_version = self.version
+            return added
+
+    async def _fetch_switch(self, switch_id: str) -> Optional[Dict[str, Any]]:
+        """Fetch a single switch, or None if it no longer exists upstream"""
+        from pluralkit import pk_request
+        resp = await pk_request("GET", f"/systems/@me/switches/{switch_id}")
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _sync_new(self) -> int:
+        """Page from the newest switch backwards until we're past the newest stored one"""
+        latest = self.latest()
+        if latest is None:
+            return 0  # nothing stored yet, the backfill fetches everything
+
+        added = 0
+        before = None
+        fetched = set()
+        oldest_us = None
+        while True:
+            page = await self._fetch_page(before)
+            if not page:
+                break
+            added += self.add_switches(page)
+            fetched.update(switch["id"] for switch in page)
+            # Stop by time rather than by id, so a stored switch deleted upstream can't send us through the whole history
+            oldest_us = _timestamp_to_us(page[-1]["timestamp"])
+            if oldest_us <= latest["ts_us"] or len(page) < PAGE_SIZE:
+                break
+            before = page[-1]["timestamp"]
+        if added:
+            print(f"Stored {added} new switches")
+        if oldest_us is not None:
+            await self._reconcile_missing(oldest_us, fetched)
+        return added
+
+    async def _reconcile_missing(self, since_us: int, fetched: set):
+        """
+        Check stored switches after since_us that the pages didn't include.
+
+        Every switch after since_us was on the pages we just fetched, so stored
+        ones that weren't were deleted upstream or moved to another time.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM switches WHERE ts_us > ?", (since_us,)).fetchall()
+        for (switch_id,) in rows:
+            if switch_id in fetched:
+                continue
+            switch = await self._fetch_switch(switch_id)
+            if switch is None:
+                print(f"Switch {switch_id} no longer exists upstream, removing it")
+                self.delete_switch(switch_id)
+            else:
+                self.update_switch(switch_id, switch)
+
+    async def _backfill(self) -> int:
+        """Page backwards from the oldest stored switch until PluralKit runs out"""
+        with self._lock:
+            row = self._conn.execute("SELECT timestamp FROM switches ORDER BY ts_us, id LIMIT 1").fetchone()
+        before = row[0] if row else None
+
+        added = 0
+        while True:
+            page = await self._fetch_page(before)
+            added += self.add_switches(page)
+            if len(page) < PAGE_SIZE:
+                with self._lock:
+                    self._set_meta("backfill_complete", "1")
+                print(f"Switch history backfill complete, {self.count()} switches stored")
+                self._notify()
+                return added
+            before = page[-1]["timestamp"]
+            # A long backfill keeps the lease; if another worker took it over, leave the rest to them
+            if not self.acquire_sync_lease():
+                print("Switch sync lease taken over by another worker, pausing the backfill")
+                return added
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "switches": self.count(),
+            "version": self.version,
+            "rewrite_version": self.rewrite_version,
+            "backfill_complete": self.backfill_complete,
+            "last_sync": self.last_sync,
+            "sync_leader": self.holds_sync_lease(),
+        }
+
+
+def _row_to_switch(row) -> Dict[str, Any]:
+    switch = {"id": row[0], "timestamp": row[1], "members": json.loads(row[2])}
+    if len(row) > 3:
+        switch["ts_us"] = row[3]
+    return switch
+
+
+switch_store = SwitchStore()
+
+# ============================================================================
+# BACKGROUND SYNC
+# ============================================================================
+
+_sync_task: Optional[asyncio.Task] = None
+_pending_syncs = set()
+
+async def _sync_loop(interval: int):
+    from pluralkit import PRIORITY_BACKGROUND, _request_priority
+    _request_priority.set(PRIORITY_BACKGROUND)
+    while True:
+        try:
+            if switch_store.acquire_sync_lease():
+                await switch_store.sync()
+            else:
+                # Another worker syncs, just pick up what it stored
+                switch_store.check_for_changes()
+        except Exception as e:
+            print(f"Error syncing switch history: {e}")
+        await asyncio.sleep(interval)
+
+def start_switch_sync(interval: int = SWITCH_SYNC_INTERVAL):
+    """
+    Start backfilling and then periodically syncing the switch history.
+
+    Only the worker holding the sync lease talks to PluralKit; every other
+    worker checks the shared store for changes on the same interval.
+    """
+    global _sync_task
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.create_task(_sync_loop(interval))
+
+async def stop_switch_sync():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+        _sync_task = None
+        switch_store.release_sync_lease()
+
+def request_switch_sync():
+    """
+    Sync new switches soon (e.g. after a switch was made), without waiting for the result.
+
+    Any worker fetches the newest page so its own change shows up right away;
+    the backfill is left to the worker holding the sync lease.
+    """
+    async def run():
+        try:
+            await switch_store.sync(backfill=switch_store.holds_sync_lease())
+        except Exception as e:
+            print(f"Error syncing switch history: {e}")
+
+    task = asyncio.create_task(run())
+    _pending_syncs.add(task)
+    task.add_done_callback(_pending_syncs.discard)
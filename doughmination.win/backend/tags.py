@@ -1,14 +1,6 @@
-import json
-import os
 from typing import List, Dict
-from pathlib import Path
 
-# Define data directory
-DATA_DIR = Path("dough-data")
-MEMBER_TAGS_FILE = DATA_DIR / "member_tags.json"
-
-# Ensure data directory exists
-DATA_DIR.mkdir(exist_ok=True)
+from storage import get_collection
 
 # Default member tag assignments
 DEFAULT_MEMBER_TAGS = {
@@ -75,84 +67,65 @@ DEFAULT_MEMBER_TAGS = {
 }
 
 
+def _member_tags_collection():
+    """The member tags collection, created with the default tags if it doesn't exist yet"""
+    collection = get_collection("member_tags")
+    if not collection.exists():
+        collection.replace_all(DEFAULT_MEMBER_TAGS)
+    return collection
+
 def get_member_tags() -> Dict[str, List[str]]:
     """Get member tag assignments"""
-    if not os.path.exists(MEMBER_TAGS_FILE):
-        # Create default member tags file
-        save_member_tags(DEFAULT_MEMBER_TAGS)
-        return DEFAULT_MEMBER_TAGS.copy()
-    
-    with open(MEMBER_TAGS_FILE, "r") as f:
-        return json.load(f)
+    return _member_tags_collection().get_all()
 
 def save_member_tags(member_tags: Dict[str, List[str]]):
-    """Save member tags to file"""
-    with open(MEMBER_TAGS_FILE, "w") as f:
-        json.dump(member_tags, f, indent=2)
+    """Replace all member tag assignments"""
+    get_collection("member_tags").replace_all(member_tags)
 
-def get_member_tags_by_id(member_id: str, member_name: str) -> List[str]:
-    """Get tags for a specific member by ID or name"""
-    member_tags = get_member_tags()
-    
-    # First try by member name
+def get_member_tags_snapshot() -> Dict[str, List[str]]:
+    """Get member tag assignments from memory, reloaded when they change (must not be modified)"""
+    return _member_tags_collection().snapshot()
+
+def lookup_member_tags(member_tags: Dict[str, List[str]], member: Dict) -> List[str]:
+    """Find a member's tags in a tag assignment dict, by name first and then by ID"""
+    member_name = member.get("name", "")
+    member_id = member.get("id", "")
     if member_name in member_tags:
         return member_tags[member_name]
-    
-    # Then try by member ID
     if member_id in member_tags:
         return member_tags[member_id]
-    
     return []
 
 def update_member_tags(member_identifier: str, tags: List[str]) -> bool:
     """Update tags for a member (can use ID or name)"""
-    member_tags = get_member_tags()
-    member_tags[member_identifier] = tags
-    save_member_tags(member_tags)
+    _member_tags_collection().put(member_identifier, tags)
     return True
 
 def add_member_tag(member_identifier: str, tag: str) -> bool:
     """Add a single tag to a member"""
-    member_tags = get_member_tags()
-    if member_identifier not in member_tags:
-        member_tags[member_identifier] = []
+    collection = _member_tags_collection()
+    tags = collection.get(member_identifier) or []
     
-    if tag not in member_tags[member_identifier]:
-        member_tags[member_identifier].append(tag)
-        save_member_tags(member_tags)
+    if tag not in tags:
+        collection.put(member_identifier, tags + [tag])
         return True
     
     return False
 
 def remove_member_tag(member_identifier: str, tag: str) -> bool:
     """Remove a single tag from a member"""
-    member_tags = get_member_tags()
-    if member_identifier in member_tags and tag in member_tags[member_identifier]:
-        member_tags[member_identifier].remove(tag)
-        save_member_tags(member_tags)
+    collection = _member_tags_collection()
+    tags = collection.get(member_identifier)
+    if tags is not None and tag in tags:
+        tags.remove(tag)
+        collection.put(member_identifier, tags)
         return True
     
     return False
 
-def enrich_members_with_tags(members: List[Dict]) -> List[Dict]:
-    """Add tag information to all members"""
-    enriched_members = []
-    
-    for member in members:
-        member_name = member.get("name", "")
-        member_id = member.get("id", "")
-        
-        # Get tags for this member
-        tags = get_member_tags_by_id(member_id, member_name)
-        
-        # Add tags to member data
-        member_with_tags = {**member, "tags": tags}
-        enriched_members.append(member_with_tags)
-    
-    return enriched_members
-
 def initialize_default_tags():
     """Initialize default member tags if they don't exist"""
-    if not os.path.exists(MEMBER_TAGS_FILE):
-        save_member_tags(DEFAULT_MEMBER_TAGS)
+    collection = get_collection("member_tags")
+    if not collection.exists():
+        collection.replace_all(DEFAULT_MEMBER_TAGS)
         print("Initialized default member tags")
\ No newline at end of file
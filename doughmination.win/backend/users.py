@@ -1,18 +1,10 @@
-import json
 import os
+import threading
 import uuid
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from passlib.hash import bcrypt
 from models import User, UserCreate, UserResponse, UserUpdate
-from pathlib import Path
-import time
-
-# Define data directory
-DATA_DIR = Path("dough-data")
-USERS_FILE = DATA_DIR / "users.json"
-
-# Ensure data directory exists
-DATA_DIR.mkdir(exist_ok=True)
+from storage import get_collection
 
 def get_owner_username() -> str:
     """Get the owner username from environment variable"""
@@ -24,54 +16,116 @@ def is_owner_username(username: str) -> bool:
     """Check if a username matches the owner username"""
     return username.lower() == get_owner_username().lower()
 
-def get_users() -> List[User]:
-    if not os.path.exists(USERS_FILE):
-        return []
-    
-    with open(USERS_FILE, "r") as f:
-        users_data = json.load(f)
+def _user_from_record(user_dict: Dict) -> User:
+    # Handle migration from old format (add missing fields)
+    if 'is_owner' not in user_dict:
+        user_dict['is_owner'] = False
+    if 'is_pet' not in user_dict:
+        user_dict['is_pet'] = False
     
-    users = []
-    for user_dict in users_data:
-        # Handle migration from old format (add missing fields)
-        if 'is_owner' not in user_dict:
-            user_dict['is_owner'] = False
-        if 'is_pet' not in user_dict:
-            user_dict['is_pet'] = False
-        
-        # Force is_owner=True for the owner username
-        if is_owner_username(user_dict.get('username', '')):
-            user_dict['is_owner'] = True
-            user_dict['is_admin'] = True  # Owner is always admin
-        
-        users.append(User(**user_dict))
+    # Force is_owner=True for the owner username
+    if is_owner_username(user_dict.get('username', '')):
+        user_dict['is_owner'] = True
+        user_dict['is_admin'] = True  # Owner is always admin
     
-    return users
+    return User(**user_dict)
+
+# Marks the in-memory users as out of date after a write, whatever the storage version is
+_STALE = object()
+
+class UserStore:
+    """
+    Users kept in memory, indexed by id and lowercase username.
+
+    The users are only loaded again when the storage version changes, which
+    also picks up writes by other workers, so a lookup is a version check and
+    a dict lookup. Writes go through to storage first and the next read
+    reloads. Users handed out are shared, so callers must not modify them.
+    """
+
+    def __init__(self, collection=None):
+        self.collection = collection if collection is not None else get_collection("users")
+        self._lock = threading.Lock()
+        self._users: List[User] = []
+        self._by_id: Dict[str, User] = {}
+        self._by_username: Dict[str, User] = {}
+        self._version: Any = _STALE
+
+    def _index(self, users: List[User]):
+        self._users = users
+        self._by_id = {}
+        self._by_username = {}
+        for user in users:
+            self._by_id.setdefault(user.id, user)
+            self._by_username.setdefault(user.username.lower(), user)
+
+    def _refresh(self):
+        if self.collection.version() == self._version:
+            return
+        with self._lock:
+            # Taken before reading, so a write that lands mid-read is picked up next time
+            version = self.collection.version()
+            if version == self._version:
+                return
+            self._index([_user_from_record(record) for record in self.collection.get_all().values()])
+            self._version = version
+
+    def all(self) -> List[User]:
+        self._refresh()
+        return list(self._users)
+
+    def get_by_id(self, user_id: str) -> Optional[User]:
+        self._refresh()
+        return self._by_id.get(user_id)
+
+    def get_by_username(self, username: str) -> Optional[User]:
+        self._refresh()
+        return self._by_username.get(username.lower())
+
+    def put(self, user: User):
+        with self._lock:
+            self.collection.put(user.id, user.dict())
+            self._version = _STALE
+
+    def remove(self, user_id: str) -> bool:
+        with self._lock:
+            removed = self.collection.delete(user_id)
+            self._version = _STALE
+        return removed
+
+    def save(self, users: List[User]):
+        with self._lock:
+            self.collection.replace_all({user.id: user.dict() for user in users})
+            self._version = _STALE
+
+user_store = UserStore()
+
+def get_users() -> List[User]:
+    return user_store.all()
 
 def save_users(users: List[User]):
     # Ensure owner always has owner and admin flags set
-    owner_username = get_owner_username()
     for user in users:
         if is_owner_username(user.username):
             user.is_owner = True
             user.is_admin = True
     
-    with open(USERS_FILE, "w") as f:
-        json.dump([user.dict() for user in users], f, indent=2)
+    user_store.save(users)
+
+def save_user(user: User):
+    """Write a single new or changed user"""
+    # Ensure owner always has owner and admin flags set
+    if is_owner_username(user.username):
+        user.is_owner = True
+        user.is_admin = True
+    
+    user_store.put(user)
 
 def get_user_by_username(username: str) -> Optional[User]:
-    users = get_users()
-    for user in users:
-        if user.username.lower() == username.lower():
-            return user
-    return None
+    return user_store.get_by_username(username)
 
 def get_user_by_id(user_id: str) -> Optional[User]:
-    users = get_users()
-    for user in users:
-        if user.id == user_id:
-            return user
-    return None
+    return user_store.get_by_id(user_id)
 
 def create_user(user_create: UserCreate, requesting_user: Optional[User] = None) -> User:
     """
@@ -85,8 +139,6 @@ def create_user(user_create: UserCreate, requesting_user: Optional[User] = None)
         ValueError: If username exists
         PermissionError: If trying to create owner or unauthorized action
     """
-    users = get_users()
-    
     # Check if username already exists
     if get_user_by_username(user_create.username):
         raise ValueError(f"Username '{user_create.username}' already exists")
@@ -119,8 +171,7 @@ def create_user(user_create: UserCreate, requesting_user: Optional[User] = None)
         avatar_url=None
     )
     
-    users.append(new_user)
-    save_users(users)
+    save_user(new_user)
     
     return new_user
 
@@ -137,65 +188,63 @@ def update_user(user_id: str, user_update: UserUpdate, requesting_user: Optional
         PermissionError: If trying to change owner permissions or unauthorized changes
         ValueError: If current password is incorrect
     """
-    users = get_users()
+    user = get_user_by_id(user_id)
     
-    for i, user in enumerate(users):
-        if user.id == user_id:
-            # BLOCK: Prevent changing owner's is_owner or is_admin flags
-            if user.is_owner:
-                if user_update.is_admin is False:
-                    raise PermissionError("Cannot remove admin privileges from owner")
-            
-            # BLOCK: Only owner can modify admin accounts (except themselves)
-            if requesting_user and user.is_admin and requesting_user.id != user.id:
-                if not requesting_user.is_owner:
-                    raise PermissionError("Only the owner can modify admin accounts")
-            
-            # Verify current password if attempting to change password
-            if user_update.current_password and user_update.new_password:
-                if not bcrypt.verify(user_update.current_password, user.password_hash):
-                    raise ValueError("Current password is incorrect")
-                
-                # Update password hash
-                password_hash = bcrypt.hash(user_update.new_password)
-            else:
-                # Keep existing password
-                password_hash = user.password_hash
-            
-            # Determine new permissions
-            # BLOCK: is_owner can NEVER be changed (always based on username)
-            new_is_owner = is_owner_username(user.username)
-            
-            # Update is_admin (but force True for owner)
-            if new_is_owner:
-                new_is_admin = True  # Owner is always admin
-            elif user_update.is_admin is not None:
-                new_is_admin = user_update.is_admin
-            else:
-                new_is_admin = user.is_admin
-            
-            # Update is_pet
-            if user_update.is_pet is not None:
-                new_is_pet = user_update.is_pet
-            else:
-                new_is_pet = user.is_pet
-            
-            # Update the user
-            updated_user = User(
-                id=user.id,
-                username=user.username,
-                password_hash=password_hash,
-                display_name=user_update.display_name if user_update.display_name is not None else user.display_name,
-                is_admin=new_is_admin,
-                is_owner=new_is_owner,
-                is_pet=new_is_pet,
-                avatar_url=user_update.avatar_url if user_update.avatar_url is not None else getattr(user, 'avatar_url', None)
-            )
-            users[i] = updated_user
-            save_users(users)
-            return updated_user
+    if user is None:
+        return None
     
-    return None
+    # BLOCK: Prevent changing owner's is_owner or is_admin flags
+    if user.is_owner:
+        if user_update.is_admin is False:
+            raise PermissionError("Cannot remove admin privileges from owner")
+    
+    # BLOCK: Only owner can modify admin accounts (except themselves)
+    if requesting_user and user.is_admin and requesting_user.id != user.id:
+        if not requesting_user.is_owner:
+            raise PermissionError("Only the owner can modify admin accounts")
+    
+    # Verify current password if attempting to change password
+    if user_update.current_password and user_update.new_password:
+        if not bcrypt.verify(user_update.current_password, user.password_hash):
+            raise ValueError("Current password is incorrect")
+        
+        # Update password hash
+        password_hash = bcrypt.hash(user_update.new_password)
+    else:
+        # Keep existing password
+        password_hash = user.password_hash
+    
+    # Determine new permissions
+    # BLOCK: is_owner can NEVER be changed (always based on username)
+    new_is_owner = is_owner_username(user.username)
+    
+    # Update is_admin (but force True for owner)
+    if new_is_owner:
+        new_is_admin = True  # Owner is always admin
+    elif user_update.is_admin is not None:
+        new_is_admin = user_update.is_admin
+    else:
+        new_is_admin = user.is_admin
+    
+    # Update is_pet
+    if user_update.is_pet is not None:
+        new_is_pet = user_update.is_pet
+    else:
+        new_is_pet = user.is_pet
+    
+    # Update the user
+    updated_user = User(
+        id=user.id,
+        username=user.username,
+        password_hash=password_hash,
+        display_name=user_update.display_name if user_update.display_name is not None else user.display_name,
+        is_admin=new_is_admin,
+        is_owner=new_is_owner,
+        is_pet=new_is_pet,
+        avatar_url=user_update.avatar_url if user_update.avatar_url is not None else getattr(user, 'avatar_url', None)
+    )
+    save_user(updated_user)
+    return updated_user
 
 def delete_user(user_id: str, requesting_user: Optional[User] = None) -> bool:
     """
@@ -208,14 +257,8 @@ def delete_user(user_id: str, requesting_user: Optional[User] = None) -> bool:
     Raises:
         PermissionError: If trying to delete owner or unauthorized action
     """
-    users = get_users()
-    
     # Find the user to delete
-    user_to_delete = None
-    for user in users:
-        if user.id == user_id:
-            user_to_delete = user
-            break
+    user_to_delete = get_user_by_id(user_id)
     
     if not user_to_delete:
         return False
@@ -230,14 +273,7 @@ def delete_user(user_id: str, requesting_user: Optional[User] = None) -> bool:
             raise PermissionError("Only the owner can delete admin accounts")
     
     # Perform deletion
-    original_count = len(users)
-    users = [user for user in users if user.id != user_id]
-    
-    if len(users) < original_count:
-        save_users(users)
-        return True
-    
-    return False
+    return user_store.remove(user_id)
 
 def verify_user(username: str, password: str) -> Optional[User]:
     user = get_user_by_username(username)
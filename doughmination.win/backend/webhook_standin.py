@@ -0,0 +1,73 @@
+"""
+Local stand-in for PluralKit's dispatch webhooks.
+
+Posts canned dispatch events to a running backend so the webhook receiver can
+be tested without registering a real webhook:
+
+    python webhook_standin.py CREATE_SWITCH
+    python webhook_standin.py UPDATE_MEMBER --id abcde --data '{"pronouns": "she/her"}'
+    python webhook_standin.py PING --url http://localhost:8000/api/webhooks/pluralkit
+
+The signing token is read from PLURALKIT_WEBHOOK_TOKEN, like the backend does.
+"""
+import argparse
+import json
+import os
+import sys
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_URL = "http://localhost:8000/api/webhooks/pluralkit"
+
+# Canned event bodies, shaped like PluralKit's dispatch payloads
+CANNED_EVENTS = {
+    "PING": {"id": None, "data": None},
+    "UPDATE_SYSTEM": {"id": None, "data": {"description": "Updated by the webhook stand-in"}},
+    "CREATE_MEMBER": {"id": "abcde", "data": {"name": "Stand-in"}},
+    "UPDATE_MEMBER": {"id": "abcde", "data": {"pronouns": "they/them"}},
+    "DELETE_MEMBER": {"id": "abcde", "data": None},
+    "CREATE_SWITCH": {"id": "00000000-0000-0000-0000-000000000000", "data": {"members": []}},
+    "UPDATE_SWITCH": {"id": "00000000-0000-0000-0000-000000000000", "data": {"members": []}},
+    "DELETE_SWITCH": {"id": "00000000-0000-0000-0000-000000000000", "data": None},
+    "DELETE_ALL_SWITCHES": {"id": None, "data": None},
+}
+
+
+def build_event(event_type: str, token: str, entity_id=None, data=None) -> dict:
+    canned = CANNED_EVENTS.get(event_type, {"id": None, "data": None})
+    return {
+        "type": event_type,
+        "signing_token": token,
+        "system_id": "stand-in",
+        "id": entity_id if entity_id is not None else canned["id"],
+        "guild_id": None,
+        "data": data if data is not None else canned["data"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post canned PluralKit dispatch events to the backend")
+    parser.add_argument("event", choices=sorted(CANNED_EVENTS), help="dispatch event type to send")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"webhook URL (default: {DEFAULT_URL})")
+    parser.add_argument("--id", dest="entity_id", help="entity id to put in the event")
+    parser.add_argument("--data", help="JSON object to use as the event data")
+    parser.add_argument("--token", default=os.getenv("PLURALKIT_WEBHOOK_TOKEN"), help="signing token")
+    args = parser.parse_args()
+
+    if not args.token:
+        print("No signing token, set PLURALKIT_WEBHOOK_TOKEN or pass --token")
+        sys.exit(1)
+
+    data = json.loads(args.data) if args.data else None
+    event = build_event(args.event, args.token, args.entity_id, data)
+
+    resp = httpx.post(args.url, json=event, timeout=10)
+    print(f"{resp.status_code} {resp.text}")
+    sys.exit(0 if resp.status_code == 200 else 1)
+
+
+if __name__ == "__main__":
+    main()
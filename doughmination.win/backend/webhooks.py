@@ -0,0 +1,128 @@
+import hmac
+import os
+from typing import Any, Dict, Set
+
+from dotenv import load_dotenv
+from cache import get_cache_entry, set_in_cache, delete_from_cache
+from switch_store import switch_store, request_switch_sync
+from pluralkit import (
+    CACHE_MAX_STALE, TAG_SYSTEM, TAG_MEMBERS,
+    invalidate_member_data, invalidate_fronter_data
+)
+
+load_dotenv()
+
+# Signing token shown by PluralKit when the webhook URL is registered (pk;s webhook <url>)
+PLURALKIT_WEBHOOK_TOKEN = os.getenv("PLURALKIT_WEBHOOK_TOKEN")
+
+# Dispatch event types we react to, grouped by the cached data they affect
+SYSTEM_EVENTS = {"UPDATE_SYSTEM"}
+MEMBER_EVENTS = {"CREATE_MEMBER", "UPDATE_MEMBER", "DELETE_MEMBER"}
+SWITCH_EVENTS = {"CREATE_SWITCH", "UPDATE_SWITCH", "DELETE_SWITCH", "DELETE_ALL_SWITCHES"}
+
+
+def is_webhook_configured() -> bool:
+    return bool(PLURALKIT_WEBHOOK_TOKEN)
+
+
+def verify_dispatch(payload: Dict[str, Any]) -> bool:
+    """Check a dispatch payload carries our webhook's signing token"""
+    if not PLURALKIT_WEBHOOK_TOKEN:
+        return False
+    token = payload.get("signing_token")
+    if not isinstance(token, str):
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), PLURALKIT_WEBHOOK_TOKEN.encode("utf-8"))
+
+
+def apply_dispatch_event(payload: Dict[str, Any]) -> Set[str]:
+    """
+    Update cached data for a verified dispatch event.
+
+    Entries are patched in place where the event carries the new data, and
+    invalidated otherwise. Returns which kinds of data changed ("system",
+    "members", "fronters") so the caller can notify clients.
+    """
+    event_type = payload.get("type")
+    entity_id = payload.get("id")
+    data = payload.get("data") or {}
+    changed: Set[str] = set()
+
+    if event_type in SYSTEM_EVENTS:
+        _patch_system(data)
+        changed.add("system")
+
+    elif event_type == "UPDATE_MEMBER" and entity_id and _patch_member(entity_id, data):
+        changed.add("members")
+        if _is_fronting(entity_id):
+            delete_from_cache("fronters")
+            changed.add("fronters")
+
+    elif event_type in MEMBER_EVENTS:
+        # Member created/deleted (or not cached yet), refetch members and fronters
+        invalidate_member_data()
+        changed.update(("members", "fronters"))
+
+    elif event_type in SWITCH_EVENTS:
+        invalidate_fronter_data()
+        _apply_switch_event(event_type, entity_id, data)
+        changed.add("fronters")
+
+    return changed
+
+
+def _patch_system(data: Dict[str, Any]):
+    entry = get_cache_entry("system")
+    if entry is None:
+        return
+    system, _ = entry
+    set_in_cache("system", {**system, **data}, stale_ttl=CACHE_MAX_STALE, tags=(TAG_SYSTEM,))
+
+
+def _patch_member(entity_id: str, data: Dict[str, Any]) -> bool:
+    """Merge updated fields into the cached raw member list, returning False if it isn't cached"""
+    entry = get_cache_entry("members_raw")
+    if entry is None:
+        return False
+    raw_members, _ = entry
+
+    patched = []
+    found = False
+    for member in raw_members:
+        if entity_id in (member.get("id"), member.get("uuid")):
+            member = {**member, **data}
+            found = True
+        patched.append(member)
+    if not found:
+        return False
+
+    set_in_cache("members_raw", patched, tags=(TAG_MEMBERS,))
+    # The processed list is rebuilt from the patched raw list on next read, without a PluralKit call
+    delete_from_cache("members")
+    return True
+
+
+def _apply_switch_event(event_type: str, entity_id: str, data: Dict[str, Any]):
+    """Keep the local switch history in step with switch events"""
+    if event_type == "DELETE_ALL_SWITCHES":
+        switch_store.clear()
+        return
+    if event_type == "DELETE_SWITCH" and entity_id:
+        switch_store.delete_switch(entity_id)
+        return
+    if event_type == "UPDATE_SWITCH" and entity_id and switch_store.update_switch(entity_id, data):
+        return
+    if event_type == "CREATE_SWITCH" and entity_id and data.get("timestamp") and switch_store.backfill_complete:
+        switch_store.add_switches([{"id": entity_id, "timestamp": data["timestamp"], "members": data.get("members", [])}])
+        return
+
+    # Not enough data in the event to apply it locally, fetch it instead
+    request_switch_sync()
+
+
+def _is_fronting(entity_id: str) -> bool:
+    entry = get_cache_entry("fronters")
+    if entry is None:
+        return False
+    fronters, _ = entry
+    return any(entity_id in (member.get("id"), member.get("uuid")) for member in fronters.get("members", []))